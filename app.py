@@ -1,10 +1,16 @@
 import os
 import sqlite3
 import datetime
+import json
+import atexit
+import uuid
 import threading
 import time
 import re
 import gevent
+import gevent.event
+import gevent.queue
+import msgspec
 from gevent import monkey
 monkey.patch_all()
 
@@ -14,15 +20,19 @@ monkey.patch_all()
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask import Flask, request, redirect, render_template, request, session, flash, url_for, current_app
-from flask_socketio import SocketIO, emit, join_room
+from flask import Flask, request, redirect, render_template, request, session, flash, url_for, current_app, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_session import Session
 from functools import wraps
+from collections import deque, namedtuple, OrderedDict
+from itertools import islice
+from bisect import bisect_left, bisect_right
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, func, select, insert, update, delete, case, literal, or_, true
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import sessionmaker
 
 
 # Load environment variables from .env file
@@ -31,8 +41,26 @@ load_dotenv()
 # Configure application
 app = Flask(__name__)
 
+
+
+class MsgspecJSON:
+    """Stand-in for the json module in Socket.IO packets, so payload structs are encoded by msgspec."""
+    encoder = msgspec.json.Encoder()
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return MsgspecJSON.encoder.encode(obj).decode()
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        try:
+            return msgspec.json.decode(s)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e))  # Engine.IO tells plain text packets such as "probe" from JSON by this error
+
+
 # Initialize Flask-SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")  # Allow all origins for local development
+socketio = SocketIO(app, cors_allowed_origins="*", json=MsgspecJSON)  # Allow all origins for local development
 
 # Set the secret key
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
@@ -57,6 +85,49 @@ if DATABASE_URL.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Queue engine: "database" reads the queue from the database on every request,
+# "memory" keeps the queue in process memory and writes it behind to the database
+app.config['BUBBLE_ENGINE'] = os.getenv('BUBBLE_ENGINE', 'database')
+app.config['BUBBLE_JOURNAL'] = os.getenv('BUBBLE_JOURNAL', 'bubble_journal.log')
+app.config['WRITE_BEHIND_INTERVAL'] = float(os.getenv('WRITE_BEHIND_INTERVAL', '0.5'))  # Seconds between batched writes
+
+# Submissions arriving within this window are settled in one transaction
+app.config['SETTLEMENT_BATCH_WINDOW'] = float(os.getenv('SETTLEMENT_BATCH_WINDOW', '0.01'))  # Seconds
+app.config['SETTLEMENT_MAX_BATCH'] = int(os.getenv('SETTLEMENT_MAX_BATCH', '100'))
+app.config['SETTLEMENT_TIMEOUT'] = float(os.getenv('SETTLEMENT_TIMEOUT', '30'))  # Seconds a request waits for its settlement
+
+# Recent idempotency keys and their settlement results
+app.config['IDEMPOTENCY_CACHE_SIZE'] = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+app.config['IDEMPOTENCY_TTL'] = float(os.getenv('IDEMPOTENCY_TTL', '600'))  # Seconds
+
+# Lease on the database lock row that elects the worker running the round timer
+app.config['TIMER_LEASE_TTL'] = float(os.getenv('TIMER_LEASE_TTL', '10'))  # Seconds
+
+# Round timer: seconds without a new bubble before the round expires, and how
+# many times faster than real time the clock runs (for load tests)
+app.config['ROUND_LENGTH'] = int(os.getenv('ROUND_LENGTH', '86400'))  # 24 hours
+app.config['CLOCK_SPEED'] = float(os.getenv('CLOCK_SPEED', '1'))
+
+# Recent broadcasts kept in memory so reconnecting clients only fetch what they missed
+app.config['STATE_STREAM_SIZE'] = int(os.getenv('STATE_STREAM_SIZE', '1000'))
+
+# Broadcasts to the same room within this window go out as one frame, 0 sends each at once
+app.config['BROADCAST_WINDOW'] = float(os.getenv('BROADCAST_WINDOW', '0.05'))  # Seconds
+
+# Frames a client may have waiting before broadcasts are held back for it, and
+# how long it may stay behind before it is disconnected
+app.config['OUTBOUND_QUEUE_SIZE'] = int(os.getenv('OUTBOUND_QUEUE_SIZE', '100'))
+app.config['SLOW_CLIENT_TIMEOUT'] = float(os.getenv('SLOW_CLIENT_TIMEOUT', '30'))  # Seconds
+
+# Send queue rows as one list of column names and an array of values per row
+app.config['COLUMNAR_PAYLOADS'] = os.getenv('COLUMNAR_PAYLOADS', '0') == '1'
+
+# Local broker (relay_broker.py) that relays broadcasts between worker processes, unset for a single worker
+app.config['RELAY_PUBLISH_URL'] = os.getenv('RELAY_PUBLISH_URL', '')
+app.config['RELAY_SUBSCRIBE_URL'] = os.getenv('RELAY_SUBSCRIBE_URL', '')
+# Seconds between the heartbeats that let the other workers notice lost relayed events
+app.config['RELAY_HEARTBEAT_INTERVAL'] = float(os.getenv('RELAY_HEARTBEAT_INTERVAL', '5'))
+
 db = SQLAlchemy()
 db.init_app(app)  # Register db with the app
 migrate = Migrate(app, db)
@@ -77,6 +148,8 @@ class Dublbubl(db.Model):
     points_in = db.Column(db.Integer, nullable=False)
     points_out = db.Column(db.Integer, nullable=False)
     date_created = db.Column(db.String(255), nullable=False)
+    running_total = db.Column(db.Integer, index=True)  # Sum of points_out of this row and every row queued before it
+    queue_position = db.Column(db.Integer)  # Number of rows queued up to and including this one
 
 class DublbublHistory(db.Model):
     history_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -94,6 +167,38 @@ class PointsTracker(db.Model):
     tracker_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     current_points_in = db.Column(db.Integer, nullable=False)
     date_created = db.Column(db.String(255), nullable=False)
+    # Counters of the rows in dublbubl, moved in the same transaction as the rows themselves
+    queue_length = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    queued_points_in = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    queued_points_out = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+class Rounds(db.Model):
+    round_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    started_at = db.Column(db.String(255))  # ended_at of the previous round, empty for the first archived round
+    ended_at = db.Column(db.String(255), nullable=False)
+    total_rows = db.Column(db.Integer, nullable=False)  # Rows paid out plus rows forfeited
+    volume = db.Column(db.Integer, nullable=False)  # points_in of every row submitted during the round
+    rows_paid = db.Column(db.Integer, nullable=False)
+    points_paid = db.Column(db.Integer, nullable=False)  # points_out of the rows that were paid out
+    rows_forfeited = db.Column(db.Integer, nullable=False)
+    points_forfeited = db.Column(db.Integer, nullable=False)  # points_out still owed to the rows left in the queue
+    pool_forfeited = db.Column(db.Integer, nullable=False)  # points_tracker pool left when the round expired
+    last_history_id = db.Column(db.Integer)  # Highest dublbubl_history row archived by the end of the round
+
+class RoundRows(db.Model):
+    round_row_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    round_id = db.Column(db.Integer, db.ForeignKey('rounds.round_id'), nullable=False, index=True)
+    row_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    username = db.Column(db.String(150), nullable=False)
+    points_in = db.Column(db.Integer, nullable=False)
+    points_out = db.Column(db.Integer, nullable=False)
+    date_created = db.Column(db.String(255), nullable=False)
+
+class Leases(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100))  # Worker holding the lease
+    expires_at = db.Column(db.Float, nullable=False)  # Unix time at which the lease lapses unless renewed
 
 
 # Assuming you have already defined the Base class and models
@@ -159,149 +264,2249 @@ def is_valid_username(username):
     return True, ""
 
 
-# Global flag to prevent multiple background tasks
-timer_running = False
+# Number of dublbubl rows shown per page of the queue table
+ROWS_PER_PAGE = 20
 
-# Background countdown timer using socketio.start_background_task()
-def countdown_timer():
-    global timer_running  # Use the global flag to control the task state
-    with app.app_context():  # Push the app context for this background task
-        Session = scoped_session(sessionmaker(bind=db.engine))  # Create a scoped session for the thread
+# Queue pages each worker keeps rendered for GET /
+CACHED_PAGES = 256
 
-    while True:
-        session = Session()
-        # Open a new database connection to get the last row's timestamp
-        last_row = session.query(Dublbubl).with_entities(Dublbubl.date_created).order_by(Dublbubl.row_id.desc()).first()
-        if last_row:
-            last_timestamp = datetime.datetime.strptime(last_row[0], "%Y-%m-%d %H:%M:%S")
+# Largest batch accepted by /api/bubbles
+MAX_SUBMISSIONS_PER_REQUEST = 50
+
+# Reply to a submission still settling after SETTLEMENT_TIMEOUT; a retry with the same idempotency key gets its result
+SETTLEMENT_PENDING_ERROR = "Your bubble is still being settled. Check back in a moment."
+
+# Seconds a worker waits at startup for the relay broker to carry its own messages back
+RELAY_HANDSHAKE_TIMEOUT = 10
+
+
+class Clock:
+    """UTC clock used for row timestamps and the round timer.
+
+    With a speed above 1 the clock starts at the real time and then runs that
+    many times faster, so a load test can play through a whole day of rounds
+    in minutes. Code reads the module level clock at call time, so a test can
+    also swap in its own.
+    """
+
+    def __init__(self, speed=1):
+        self.speed = speed
+        self.origin = datetime.datetime.now(datetime.timezone.utc)
+        self.origin_monotonic = time.monotonic()
+
+    def now(self):
+        if self.speed == 1:
+            return datetime.datetime.now(datetime.timezone.utc)
+        elapsed = (time.monotonic() - self.origin_monotonic) * self.speed
+        return self.origin + datetime.timedelta(seconds=elapsed)
+
+    def timestamp(self):
+        """The current time in the format stored in date_created."""
+        return self.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def real_seconds(self, seconds):
+        """Real time to wait for this many seconds to pass on the clock."""
+        return seconds / self.speed
+
+
+clock = Clock(app.config['CLOCK_SPEED'])
+
+
+def calculate_points_out(points):
+    """Apply the return multiplier for the points range of points_in."""
+    if points >= 10000:
+        return points * 2  # If points are 10,000 or more, multiply by 2
+    elif points >= 5000:
+        return points * 1.75  # If points are 5,000 or more but less than 10,000, multiply by 1.75
+    elif points >= 1000:
+        return points * 1.5  # If points are 1,000 or more but less than 5,000, multiply by 1.5
+    return points * 1.25  # Otherwise multiply by 1.25 for smaller amounts
+
+
+def parse_points(points):
+    """Validate submitted points, returning a tuple of (points, error message)."""
+    # Check points are entered
+    if points is None or points == "":
+        return None, "No points entered"
+    if isinstance(points, bool):
+        return None, "Invalid input"
+    if isinstance(points, float) and not points.is_integer():
+        return None, "Points must be a whole number"  # int() would truncate a JSON 10.5
+    try:
+        points = int(points)
+    except (TypeError, ValueError):
+        return None, "Invalid input"
+
+    # Check points are positive number
+    if points <= 0 or points > 10000:
+        return None, "Points must be between 1 and 10000"
+    return points, None
+
+
+def serialize_row(row):
+    """Convert a dublbubl row into a dict that can be emitted to the front-end."""
+    return {
+        "row_id": row.row_id,
+        "user_id": row.user_id,
+        "username": row.username,
+        "points_in": row.points_in,
+        "points_out": row.points_out,
+        "date_created": row.date_created
+    }
+
+
+class StreamPayload(msgspec.Struct, kw_only=True, omit_defaults=True):
+    """Base of the payload structs published on the state stream, which tags them with channel and seq."""
+    channel: str = None
+    seq: int = None
+
+
+class QueueRow(msgspec.Struct):
+    """A queue row as sent over Socket.IO."""
+    row_id: int
+    user_id: int
+    username: str
+    points_in: int
+    points_out: float
+    date_created: str
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.row_id, row.user_id, row.username, row.points_in, row.points_out, row.date_created)
+
+
+class RowColumns(msgspec.Struct):
+    """Queue rows in columnar layout: the field names once, then the values of each row."""
+    columns: tuple
+    values: list
+
+
+class HistoryEntry(msgspec.Struct):
+    """A paid out bubble in update_user_history."""
+    bubble_number: int
+    points_invested: int
+    points_earned: float
+    created_on: str
+    archived_on: str
+
+
+class PointsInfo(StreamPayload):
+    """The pool and the points still needed to pop the queue head."""
+    current_points_in: float
+    points_in_required: float
+
+
+def pack_rows(rows):
+    """QueueRow structs for a payload, in columnar layout if COLUMNAR_PAYLOADS is set."""
+    if app.config["COLUMNAR_PAYLOADS"]:
+        return RowColumns(QueueRow.__struct_fields__, [msgspec.structs.astuple(row) for row in rows])
+    return rows
+
+
+def serialize_history(rows):
+    """Convert dublbubl_history rows into the payload used by update_user_history."""
+    return [HistoryEntry(row.row_id, row.points_in, row.points_out, row.date_created, row.date_archived) for row in rows]
+
+
+def settle_queue(pool, settler, current_date):
+    """Pay out every oldest dublbubl row that the pool covers.
+
+    The covered rows are found with one range scan over the running_total
+    index, then settled with one bulk insert into dublbubl_history, one grouped
+    balance update on users and one range delete. The caller writes the
+    remaining pool to points_tracker and commits, so the whole settlement is
+    one transaction.
+
+    Returns a tuple of (settled rows, remaining pool).
+    """
+    if pool <= 0:
+        return [], pool
+
+    base = get_queue_base()
+    if base is None:
+        return [], pool
+
+    settled = db.session.query(
+        Dublbubl.row_id,
+        Dublbubl.user_id,
+        Dublbubl.username,
+        Dublbubl.points_in,
+        Dublbubl.points_out,
+        Dublbubl.date_created,
+        Dublbubl.running_total
+    ).filter(Dublbubl.running_total <= base + pool).order_by(Dublbubl.row_id.asc()).all()
+    if not settled:
+        return [], pool
+
+    # Archive the paid out rows, recorded against the user whose points popped them
+    db.session.execute(insert(DublbublHistory), [
+        {
+            "user_id": settler.id,
+            "username": settler.username,
+            "row_id": row.row_id,
+            "creator_id": row.user_id,
+            "creator_username": row.username,
+            "points_in": row.points_in,
+            "points_out": row.points_out,
+            "date_created": row.date_created,
+            "date_archived": current_date
+        } for row in settled
+    ])
+
+    # Credit every creator once with the sum of their paid out rows
+    payouts = {}
+    for row in settled:
+        payouts[row.user_id] = payouts.get(row.user_id, 0) + row.points_out
+
+    payout = case(payouts, value=Users.id, else_=0)
+    db.session.execute(
+        update(Users)
+        .where(Users.id.in_(payouts))
+        .values(
+            points=func.coalesce(Users.points, 0) + payout,
+            total_points_earned=func.coalesce(Users.total_points_earned, 0) + payout
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    # Remove the paid out rows from the queue
+    db.session.execute(
+        delete(Dublbubl)
+        .where(Dublbubl.row_id <= settled[-1].row_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    return settled, pool - (settled[-1].running_total - base)
+
+
+def get_queue_base():
+    """Running total of every row paid out before the current queue head, or None if the queue is empty."""
+    head = db.session.query(Dublbubl.running_total, Dublbubl.points_out).order_by(Dublbubl.row_id.asc()).first()
+    if head is None:
+        return None
+    return head.running_total - head.points_out
+
+
+def assign_running_total(row_id):
+    """Set the running total and queue position of a newly queued row from the row queued before it."""
+    def previous(column):
+        return select(column) \
+            .where(Dublbubl.row_id < row_id) \
+            .order_by(Dublbubl.row_id.desc()) \
+            .limit(1) \
+            .scalar_subquery()
+
+    db.session.execute(
+        update(Dublbubl)
+        .where(Dublbubl.row_id == row_id)
+        .values(
+            running_total=func.coalesce(previous(Dublbubl.running_total), 0) + Dublbubl.points_out,
+            queue_position=func.coalesce(previous(Dublbubl.queue_position), 0) + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def points_until_payout(row_ids):
+    """Points the pool still needs before each given row pays out, by row_id, None for rows no longer queued.
+
+    The queue base and the pool are read once for all of the rows.
+    """
+    if bubble_queue is not None:
+        return {row_id: bubble_queue.index.points_until(row_id, bubble_queue.pool) for row_id in row_ids}
+
+    totals = dict(db.session.query(Dublbubl.row_id, Dublbubl.running_total).filter(Dublbubl.row_id.in_(row_ids)).all())
+    if not totals:
+        return dict.fromkeys(row_ids)
+    base = get_queue_base()
+    pool = db.session.query(PointsTracker.current_points_in).scalar() or 0
+    return {row_id: max(totals[row_id] - base - pool, 0) if row_id in totals else None for row_id in row_ids}
+
+
+def rows_cleared_by(points):
+    """Number of queued rows a deposit of points would pay out on top of the current pool."""
+    if bubble_queue is not None:
+        return bubble_queue.index.rows_cleared_by(bubble_queue.pool + points)
+
+    head = db.session.query(Dublbubl.running_total, Dublbubl.points_out, Dublbubl.queue_position).order_by(Dublbubl.row_id.asc()).first()
+    if head is None:
+        return 0
+    base = head.running_total - head.points_out
+    pool = db.session.query(PointsTracker.current_points_in).scalar() or 0
+
+    # Running totals grow with the queue, so the last row covered is one seek down the index
+    # and the rows up to it are the difference of two positions
+    last_position = db.session.query(Dublbubl.queue_position) \
+        .filter(Dublbubl.running_total <= base + pool + points) \
+        .order_by(Dublbubl.running_total.desc()) \
+        .limit(1) \
+        .scalar()
+    return 0 if last_position is None else last_position - head.queue_position + 1
+
+
+def apply_submission(user, points):
+    """Create a bubble for the user and settle the queue without committing.
+
+    Returns a dict describing the settlement: the new row, the rows paid out
+    and the remaining pool.
+    """
+    if bubble_queue is not None:
+        return bubble_queue.submit(user, points)
+
+    current_date = clock.timestamp()
+
+    # Create a new entry in the dublbubl table
+    new_row = Dublbubl(
+        user_id=user.id,
+        username=user.username,
+        points_in=points,
+        points_out=calculate_points_out(points),
+        date_created=current_date
+    )
+    db.session.add(new_row)
+
+    # Deduct the points from the user's balance
+    user.points = (user.points or 0) - points
+    db.session.flush()
+    assign_running_total(new_row.row_id)
+    new_row_dict = serialize_row(new_row)
+
+    # Check if a PointsTracker entry exists
+    points_tracker = get_points_tracker(current_date)
+
+    # Add points_in to the pool only if dublbubl has more than 1 row
+    pool = points_tracker.current_points_in
+    if points_tracker.queue_length > 0:  # Rows queued before this one
+        pool += points
+        points_tracker.date_created = current_date
+
+    settled, remaining_pool = settle_queue(pool, user, current_date)
+    if settled:
+        points_tracker.date_created = current_date
+
+    count_queue(
+        points_tracker,
+        1 - len(settled),
+        new_row.points_in - sum(row.points_in for row in settled),
+        new_row.points_out - sum(row.points_out for row in settled)
+    )
+
+    # Single points_tracker write for the whole submission
+    points_tracker.current_points_in = remaining_pool
+    db.session.flush()
+
+    return {
+        "user_id": user.id,
+        "row": new_row_dict,
+        "settled": [serialize_row(row) for row in settled],
+        "current_points_in": remaining_pool
+    }
+
+
+def get_points_tracker(current_date):
+    """The points_tracker row, created with an empty pool and queue on the first submission."""
+    points_tracker = PointsTracker.query.first()
+    if not points_tracker:
+        points_tracker = PointsTracker(current_points_in=0, date_created=current_date, queue_length=0, queued_points_in=0, queued_points_out=0)
+        db.session.add(points_tracker)
+    return points_tracker
+
+
+def count_queue(points_tracker, rows, points_in, points_out):
+    """Move the dublbubl counters on points_tracker by the rows a transaction added or removed."""
+    points_tracker.queue_length += rows
+    points_tracker.queued_points_in += points_in
+    points_tracker.queued_points_out += points_out
+
+
+def submit_bubble(user, points):
+    """Create a bubble for the user and settle the queue in a single transaction."""
+    result = apply_submission(user, points)
+    db.session.commit()
+    result["point_balance"] = get_point_balance(user)
+    return result
+
+
+# Events that carry a whole piece of state, so a later copy replaces an unsent earlier one
+COALESCED_EVENTS = {
+    "update_table", "update_pages", "update_timer", "update_points_info",
+    "update_point_balance", "update_user_history"
+}
+
+
+class SlowClients:
+    """Bounded outbound queues for clients that cannot keep up.
+
+    Engine.IO queues every frame for a client until its socket takes it, with
+    no limit, so a slow connection would keep every broadcast in memory. A
+    client with OUTBOUND_QUEUE_SIZE frames waiting is left out of broadcasts
+    and its frames are held here instead: a state event (COALESCED_EVENTS)
+    replaces the held copy of the same event on the same channel, and a delta
+    is dropped, because the next event the client applies shows it the gap
+    in seqs and it resyncs. The held frames go out as one bundle once its
+    queue has drained; a client still behind after SLOW_CLIENT_TIMEOUT
+    seconds is disconnected.
+    """
+
+    def __init__(self, queue_size, timeout):
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.held = {}  # Socket id -> {(event, channel): payload}, latest last
+        self.behind_since = {}  # Socket id -> monotonic time it fell behind
+        self.watching = False
+
+        # Metrics: state frames replaced while held, deltas dropped, clients disconnected
+        self.merged = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def backlog(self, eio_sid):
+        """Frames waiting in the client's Engine.IO queue."""
+        socket = socketio.server.eio.sockets.get(eio_sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def skipped(self, room, events):
+        """Socket ids in the room that are behind, once events are held for them."""
+        skipped = []
+        for sid, eio_sid in socketio.server.manager.get_participants("/", room):
+            if sid in self.behind_since or self.backlog(eio_sid) >= self.queue_size:
+                self.hold(sid, events)
+                skipped.append(sid)
+        return skipped
+
+    def hold(self, sid, events):
+        if sid not in self.behind_since:
+            self.behind_since[sid] = time.monotonic()
+            self.watch()
+        held = self.held.setdefault(sid, {})
+        for event, payload in events:
+            if event not in COALESCED_EVENTS:
+                self.dropped += 1
+                continue
+            channel = payload.channel if isinstance(payload, StreamPayload) else payload.get("channel")
+            if held.pop((event, channel), None) is not None:
+                self.merged += 1
+            held[(event, channel)] = payload
+
+    def watch(self):
+        if not self.watching:
+            self.watching = True
+            socketio.start_background_task(target=self.run)
+
+    def run(self):
+        """Release the clients that caught up and disconnect the ones that stayed behind."""
+        while self.behind_since:
+            gevent.sleep(1)
+            now = time.monotonic()
+            for sid, since in list(self.behind_since.items()):
+                eio_sid = socketio.server.manager.eio_sid_from_sid(sid, "/")
+                if eio_sid is None:
+                    self.forget(sid)  # Already gone
+                elif self.backlog(eio_sid) == 0:
+                    self.release(sid)
+                elif now - since > self.timeout:
+                    print(f"Disconnecting {sid}, {self.backlog(eio_sid)} frames behind for {now - since:.0f}s")
+                    self.disconnected += 1
+                    self.forget(sid)
+                    socketio.server.disconnect(sid, namespace="/")
+        self.watching = False
+
+    def release(self, sid):
+        held = self.held.get(sid)
+        self.forget(sid)
+        if held:
+            socketio.emit("bundle", {
+                "events": [{"event": event, "data": payload} for (event, channel), payload in held.items()],
+                "superseded": {}
+            }, to=sid)
+
+    def forget(self, sid):
+        self.held.pop(sid, None)
+        self.behind_since.pop(sid, None)
+
+    def stats(self):
+        return {
+            "behind": len(self.behind_since),
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "disconnected": self.disconnected
+        }
+
+
+slow_clients = SlowClients(app.config["OUTBOUND_QUEUE_SIZE"], app.config["SLOW_CLIENT_TIMEOUT"])
+
+
+class Broadcaster:
+    """Collects Socket.IO broadcasts per room and sends them once per window.
+
+    emit() queues an event for a room. When BROADCAST_WINDOW closes, every
+    room gets one frame: the event itself if only one is queued, otherwise a
+    "bundle" with all of them in order. A snapshot event (COALESCED_EVENTS)
+    replaces the unsent copy of the same event for the room, and the seqs of
+    replaced stream events are listed in the bundle so clients do not take
+    them for a gap. Deltas are always kept.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.rooms = {}  # Room -> queued (event, payload) pairs, None where replaced
+        self.latest = {}  # (room, event) -> index of the queued snapshot
+        self.superseded = {}  # Room -> {channel: [seq, ...]} of replaced stream events
+        self.flushing = False
+
+        # Metrics: events emitted, snapshots replaced before sending, frames sent
+        self.emitted = 0
+        self.coalesced = 0
+        self.frames = 0
+
+    def emit(self, event, payload, to=None):
+        self.emitted += 1
+        if not self.window:
+            self.send(event, payload, to, [(event, payload)])
+            return
+
+        queued = self.rooms.setdefault(to, [])
+        if event in COALESCED_EVENTS:
+            index = self.latest.get((to, event))
+            if index is not None:
+                replaced = queued[index][1]
+                queued[index] = None
+                self.coalesced += 1
+                if isinstance(replaced, StreamPayload):
+                    replaced = {"channel": replaced.channel, "seq": replaced.seq}
+                if "seq" in replaced:
+                    self.superseded.setdefault(to, {}).setdefault(replaced["channel"], []).append(replaced["seq"])
+            self.latest[(to, event)] = len(queued)
+        queued.append((event, payload))
+
+        if not self.flushing:
+            self.flushing = True
+            gevent.spawn_later(self.window, self.flush)
+
+    def flush(self):
+        rooms, superseded = self.rooms, self.superseded
+        self.rooms, self.latest, self.superseded = {}, {}, {}
+        self.flushing = False
+
+        for room, queued in rooms.items():
+            events = [item for item in queued if item is not None]
+            if len(events) == 1 and room not in superseded:
+                self.send(*events[0], room, events)
+            else:
+                self.send("bundle", {
+                    "events": [{"event": event, "data": payload} for event, payload in events],
+                    "superseded": superseded.get(room, {})
+                }, room, events)
+
+    def send(self, event, payload, to, events):
+        """Send a frame carrying events to the room, except to the clients that are behind."""
+        self.frames += 1
+        try:
+            socketio.emit(event, payload, to=to, skip_sid=slow_clients.skipped(to, events))
+        except Exception as e:
+            print(f"Error broadcasting {event}: {e}")
+
+    def stats(self):
+        return {"emitted": self.emitted, "coalesced": self.coalesced, "frames": self.frames}
+
+
+broadcaster = Broadcaster(app.config["BROADCAST_WINDOW"])
+
+
+class Relay:
+    """Runs broadcast handlers on every worker process, through a local ZeroMQ broker.
+
+    Each worker numbers and sends the broadcasts for its own clients, so what
+    travels between workers are the events behind them: a committed batch,
+    an expired round, an emit to a user's room. call() runs the handler on
+    this worker straight away and publishes the event to relay_broker.py for
+    the other workers, which skip the events they sent themselves. Without
+    RELAY_PUBLISH_URL and RELAY_SUBSCRIBE_URL there is only one worker to tell.
+
+    PUB/SUB drops what it cannot deliver, so every worker numbers its events
+    and sends its latest number as a heartbeat when it is idle. A worker that
+    sees a number skipped, from an event or a heartbeat, calls on_gap to read
+    the shared state again from the database.
+    """
+
+    def __init__(self, publish_url, subscribe_url):
+        self.publish_url = publish_url
+        self.subscribe_url = subscribe_url
+        self.handlers = {}
+        self.publisher = None
+        self.subscriber = None
+        self.origin = uuid.uuid4().hex  # Tells this worker's events apart from the others'
+        self.seq = 0  # Events this worker has published
+        self.last_seqs = {}  # Origin -> last seq received from that worker
+        self.on_gap = None
+
+    @property
+    def enabled(self):
+        return bool(self.publish_url and self.subscribe_url)
+
+    def handler(self, func):
+        """Register func to run on every worker when called through the relay."""
+        self.handlers[func.__name__] = func
+        return func
+
+    def start(self):
+        if not self.enabled:
+            return
+        import zmq.green as zmq  # Only needed with several workers
+
+        context = zmq.Context.instance()
+        self.publisher = context.socket(zmq.PUB)
+        self.publisher.connect(self.publish_url)
+        self.subscriber = context.socket(zmq.SUB)
+        self.subscriber.connect(self.subscribe_url)
+        self.subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+        if not self.handshake():
+            print(f"Relay broker did not answer within {RELAY_HANDSHAKE_TIMEOUT} seconds, carrying on without it")
+        socketio.start_background_task(target=self.listen)
+        socketio.start_background_task(target=self.heartbeat)
+        print(f"Relaying broadcasts through {self.publish_url} and {self.subscribe_url}")
+
+    def handshake(self):
+        """Wait until a heartbeat of our own comes back through the broker.
+
+        Until then the broker and our subscription may not be connected yet,
+        and anything published would be lost without a trace.
+        """
+        deadline = time.monotonic() + RELAY_HANDSHAKE_TIMEOUT
+        while time.monotonic() < deadline:
+            self.send_heartbeat()
+            if self.subscriber.poll(100):
+                if self.receive(self.subscriber.recv()):
+                    return True
+        return False
+
+    def call(self, name, *args):
+        if self.publisher is not None:
+            self.seq += 1
+            self.publisher.send(msgspec.msgpack.encode([self.origin, self.seq, name, args]))
+        self.handlers[name](*args)
+
+    def send_heartbeat(self):
+        self.publisher.send(msgspec.msgpack.encode([self.origin, self.seq, None, []]))
+
+    def heartbeat(self):
+        while True:
+            time.sleep(app.config["RELAY_HEARTBEAT_INTERVAL"])
+            self.send_heartbeat()
+
+    def listen(self):
+        while True:
+            self.receive(self.subscriber.recv())
+
+    def receive(self, message):
+        """Handle one relayed message; returns whether it was one of our own."""
+        name = None
+        try:
+            origin, seq, name, args = msgspec.msgpack.decode(message)
+            if origin == self.origin:
+                return True
+
+            # An event carries the next seq of its worker, a heartbeat the last one it sent
+            last = self.last_seqs.get(origin)
+            missed = last is not None and seq > last + (0 if name is None else 1)
+            self.last_seqs[origin] = max(seq, last or 0)
+
+            with app.app_context():
+                try:
+                    if name is not None:
+                        self.handlers[name](*args)
+                    if missed:
+                        print(f"Missed relayed events {last + 1} to {seq} from worker {origin}, reading the state again")
+                        self.on_gap()
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            print(f"Error handling relayed {name}: {e}")
+        return False
+
+
+relay = Relay(app.config["RELAY_PUBLISH_URL"], app.config["RELAY_SUBSCRIBE_URL"])
+
+# Several workers share one port without sticky sessions, so each client has to stay on
+# the worker it connected to: only a websocket does, long-polling requests are spread out
+SOCKET_TRANSPORTS = ["websocket"] if relay.enabled else ["polling", "websocket"]
+
+
+STATE_CHANNEL = "state"
+
+
+def queue_page_room(after):
+    """Room and stream channel of the clients showing the page of the queue that follows after."""
+    return "queue:head" if after is None else f"queue:after:{after}"
+
+
+class StateStream:
+    """Broadcasts of shared state, numbered in order and kept in ring buffers.
+
+    Every queue, pool, round and timer broadcast goes through publish(), which
+    tags it with its channel and the next seq of that channel. The "state"
+    channel reaches every client; a queue:head or queue:after:N channel only
+    the clients in that page's room. A client that reconnects or notices a gap sends the last
+    seq it applied on the channel and gets the missed events replayed from the
+    buffer, or a snapshot once they have been dropped. stream_id changes on
+    every start, so seqs from before a restart are never replayed.
+    """
+
+    def __init__(self, size):
+        self.stream_id = uuid.uuid4().hex
+        self.size = size
+        self.seqs = {}
+        self.events = {}
+
+    def seq(self, channel=STATE_CHANNEL):
+        return self.seqs.get(channel, 0)
+
+    def publish(self, event, payload, channel=STATE_CHANNEL):
+        seq = self.seqs[channel] = self.seq(channel) + 1
+        if isinstance(payload, StreamPayload):
+            payload.channel = channel
+            payload.seq = seq
         else:
-            last_timestamp = None
-
-        # This will be the main loop where the timer will wait for a new row
-        while last_timestamp:
-            # Get the current time in UTC
-            current_time = datetime.datetime.now(datetime.timezone.utc)
-
-            # Convert last_timestamp to a timezone-aware datetime if it is naive
-            if last_timestamp.tzinfo is None:
-                last_timestamp = last_timestamp.replace(tzinfo=datetime.timezone.utc)
-
-            # Calculate the remaining time until 24 hours is reached
-            remaining_time = 86400 - int((current_time - last_timestamp).total_seconds()) # 86400 seconds = 24 hours
-
-            # If the remaining time is greater than 0, update the timer and sleep for 1 second
-            if remaining_time > 0:
-                hours, remainder = divmod(remaining_time, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                formatted_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                socketio.emit("update_timer", {"time": formatted_time})  # Emit the remaining time to frontend
-                time.sleep(1)  # Sleep for 1 second before checking again
+            payload["channel"] = channel
+            payload["seq"] = seq
+        if channel not in self.events:
+            self.events[channel] = deque(maxlen=self.size)
+        self.events[channel].append((seq, event, payload))
+        broadcaster.emit(event, payload, to=None if channel == STATE_CHANNEL else channel)
+
+    def skip(self, channel):
+        """Open a gap in a channel nobody was listening to, so its next clients start from a snapshot."""
+        self.seqs[channel] = self.seq(channel) + 1
+        self.events.pop(channel, None)
+
+    def drop(self, channel):
+        """Free the buffer of a channel nobody listens to anymore."""
+        self.events.pop(channel, None)
+
+    def since(self, stream_id, seq, channel=STATE_CHANNEL):
+        """Events published on the channel after seq, or None if they can no longer all be replayed."""
+        current = self.seq(channel)
+        events = self.events.get(channel, ())
+        if stream_id != self.stream_id or not isinstance(seq, int) or seq > current:
+            return None
+        if seq < current - len(events):
+            return None  # Dropped from the buffer, or never sent
+        start = len(events) - (current - seq)
+        return [{"event": event, "data": payload} for event_seq, event, payload in islice(events, start, None)]
+
+
+state_stream = StateStream(app.config["STATE_STREAM_SIZE"])
+
+
+class PageRooms:
+    """The queue page each connected client shows.
+
+    A page is the ROWS_PER_PAGE rows that follow a row_id cursor, or the head
+    of the queue when the cursor is None, so it does not shift as the head is
+    paid out. Clients join the queue:head or queue:after:N room of their page
+    with watch_page. Only pages somebody watches are computed and sent after
+    a batch; a page that gets its first viewer skips a seq, since changes
+    made while it was unwatched were never published.
+    """
+
+    def __init__(self):
+        self.pages = {}  # Socket id -> cursor of its page
+        self.viewers = {}  # Cursor -> number of sockets showing its page
+
+    def watch(self, sid, after):
+        self.leave(sid)
+        join_room(queue_page_room(after))
+        self.pages[sid] = after
+        self.viewers[after] = self.viewers.get(after, 0) + 1
+        if self.viewers[after] == 1:
+            state_stream.skip(queue_page_room(after))
+
+    def leave(self, sid):
+        if sid not in self.pages:
+            return
+        after = self.pages.pop(sid)
+        leave_room(queue_page_room(after))
+        self.viewers[after] -= 1
+        if not self.viewers[after]:
+            del self.viewers[after]
+            state_stream.drop(queue_page_room(after))
+
+    def watched(self):
+        return sorted(self.viewers, key=lambda after: -1 if after is None else after)
+
+
+page_rooms = PageRooms()
+
+
+class QueueFeed:
+    """Changes to the queue table, sent to the room of each page they touch.
+
+    After a batch, every watched page whose rows changed gets one update. The
+    head page gets deltas: a row_added with the new rows that land on it and
+    a rows_settled that drops every row up to up_to_row_id and carries only
+    the rows that move up into the page. Any other page gets its new
+    snapshot, read by keyset from its cursor once for all of its viewers, so
+    it costs the same however deep in the queue it is. Pages the batch did
+    not touch get nothing; a change in the number of pages goes to everyone
+    as update_pages.
+
+    The head page deltas are worked out once, by the worker that committed
+    the batch; each worker then sends them and the snapshots of the pages
+    its own clients watch.
+    """
+
+    def settlement(self, results):
+        """Describe the rows added and paid out by a committed batch and hand it to every worker."""
+        total_rows = get_queue_length()
+        added = [result["row"] for result in results]
+        settled = [row for result in results for row in result["settled"]]
+        before = total_rows + len(settled) - len(added)  # Queue length before the batch
+        relay.call("queue_changed", {
+            "before": before,
+            "added": len(added),
+            "last_added": added[-1]["row_id"],
+            "settled_up_to": settled[-1]["row_id"] if settled else None,
+            "room_after": self.room_after(added, settled),
+            "total_rows": total_rows,
+            "latest_created": added[-1]["date_created"],
+            "first_page": self.first_page_deltas(added, settled, before, total_rows),
+            "points": get_points_info()  # Pool and head after the batch
+        })
+
+    def apply(self, change):
+        """Send a committed change to the pages watched on this worker that it touches."""
+        before, total_rows = change["before"], change["total_rows"]
+        for after in page_rooms.watched():
+            if not self.touches(change, after):
+                continue
+            if after is None:
+                for event, payload in change["first_page"]:
+                    state_stream.publish(event, payload, queue_page_room(None))
             else:
-                # If 30 seconds have passed, perform the cleanup
-                formatted_time = "00:00:00"  # Emit 00:00:00 when time runs out
-                print("30 seconds elapsed with no new row. Clearing dublbubl table.")
-                session.query(Dublbubl).delete()
+                state_stream.publish("update_table", self.snapshot(after), queue_page_room(after))
+
+        if count_pages(before) != count_pages(total_rows):
+            state_stream.publish("update_pages", {"total_pages": count_pages(total_rows)})
+
+    def touches(self, change, after):
+        """Whether a committed change moves any row on the page that follows after, or gives it a next page."""
+        if after is None:
+            # New rows join the tail; a full head page only changes when the head is paid out,
+            # or when the first row past it gives it a next page
+            return change["settled_up_to"] is not None or change["before"] <= ROWS_PER_PAGE
+        if change["settled_up_to"] is not None and change["settled_up_to"] > after:
+            return True  # Rows on the page were paid out
+        if after >= change["last_added"]:
+            return False  # The new rows all come before the page
+        return change["room_after"] is None or after >= change["room_after"]
+
+    def room_after(self, added, settled):
+        """The lowest cursor whose page had room for another row before the batch, or None if every page had.
+
+        Rows added at the tail land on such a page, or give it a next page.
+        """
+        first_added = added[0]["row_id"]
+        paid_out = [row["row_id"] for row in settled if row["row_id"] < first_added]  # Queued before the batch
+        kept = [row.row_id for row in get_queue_rows_before(first_added, ROWS_PER_PAGE + 1)]
+        row_ids = paid_out + kept
+        return row_ids[-ROWS_PER_PAGE - 1] if len(row_ids) > ROWS_PER_PAGE else None
+
+    def first_page_deltas(self, added, settled, before, total_rows):
+        """The row_added and rows_settled events of the head page, as (event, payload) pairs."""
+        deltas = []
+
+        # New rows join the tail in order, before any row of the batch is paid out
+        if before < ROWS_PER_PAGE:
+            deltas.append(("row_added", {
+                "rows": pack_rows([QueueRow(**row) for row in added[:ROWS_PER_PAGE - before]]),
+                "position": before
+            }))
+
+        if settled:
+            # Keep the rows after the paid out ones and fill up from the next rows
+            kept = max(min(ROWS_PER_PAGE, before + len(added)) - len(settled), 0)
+            deltas.append(("rows_settled", {
+                "up_to_row_id": settled[-1]["row_id"],
+                "count": len(settled),
+                "total_rows": total_rows,
+                "rows": pack_rows([QueueRow.from_row(row) for row in get_queue_rows(kept, ROWS_PER_PAGE - kept)])
+            }))
+        return deltas
+
+    def snapshot(self, after):
+        """A full page of rows, and whether a next page follows it."""
+        rows, more = get_queue_page(after)
+        return {
+            "rows": pack_rows([QueueRow.from_row(row) for row in rows]),
+            "after": after,
+            "more": more
+        }
+
+    def reset(self):
+        """Send the empty queue left by an expired round to every watched page."""
+        for after in page_rooms.watched():
+            state_stream.publish("update_table", {"rows": pack_rows([]), "after": after, "more": False}, queue_page_room(after))
+        state_stream.publish("update_pages", {"total_pages": 0})
+
+    def refresh(self):
+        """Send every watched page its current snapshot, whatever changed since."""
+        for after in page_rooms.watched():
+            state_stream.publish("update_table", self.snapshot(after), queue_page_room(after))
+        state_stream.publish("update_pages", {"total_pages": count_pages(get_queue_length())})
+
+
+queue_feed = QueueFeed()
+
+
+class PointsFeed:
+    """The pool and the points needed to pop the queue head, sent only when they change.
+
+    A batch that only adds rows behind the head leaves points_in_required
+    alone as long as the pool does not move, and an expired round sends the
+    same zeros every time; neither goes out again. Pages loading the
+    dashboard get the current values from the template.
+    """
+
+    def __init__(self):
+        self.last = None  # (current_points_in, points_in_required) last sent from this worker
+
+    def publish(self, info):
+        values = (info.current_points_in, info.points_in_required)
+        if values == self.last:
+            return
+        self.last = values
+        state_stream.publish("update_points_info", info)
+
+
+points_feed = PointsFeed()
+
+
+class Dashboard:
+    """Read model behind GET /, so rendering the dashboard needs no queue queries.
+
+    Holds the points info as of a state stream seq, and the rows of the
+    pages visited lately as of each page's seq, keyed by cursor. Every worker
+    keeps its own: a committed batch replaces the summary with the values
+    relayed in the change and drops the cached pages it touches, and an
+    expired round drops everything. Dropped parts are read again by the next
+    visitor. A read that overlaps a change is served but not kept, since it
+    may predate the change.
+    """
+
+    def __init__(self):
+        self.version = 0  # Bumped by every change
+        self.summary = None  # (stream_seq, PointsInfo)
+        self.pages = {}  # Cursor -> (page_seq, [QueueRow], more), oldest first
+
+    def read_summary(self):
+        if self.summary is not None:
+            return self.summary
+        version = self.version
+        summary = (state_stream.seq(), get_points_info())  # Seq first, like a resync snapshot
+        if version == self.version:
+            self.summary = summary
+        return summary
+
+    def read_page(self, after):
+        if after in self.pages:
+            return self.pages[after]
+        version = self.version
+        page_seq = state_stream.seq(queue_page_room(after))
+        rows, more = get_queue_page(after)
+        cached = (page_seq, [QueueRow.from_row(row) for row in rows], more)
+        if version == self.version:
+            # Cursors come from URLs, so the page read longest ago makes room
+            if len(self.pages) >= CACHED_PAGES:
+                del self.pages[next(iter(self.pages))]
+            self.pages[after] = cached
+        return cached
+
+    def changed(self, change, points):
+        """Take in a committed batch, once its broadcasts have been published on this worker."""
+        self.version += 1
+        self.summary = (state_stream.seq(), points)
+        for after in [after for after in self.pages if queue_feed.touches(change, after)]:
+            del self.pages[after]
+
+    def reset(self):
+        self.version += 1
+        self.summary = None
+        self.pages = {}
+
+
+dashboard = Dashboard()
+
+
+@relay.handler
+def queue_changed(change):
+    """On every worker: move the round deadline forward and send the change to the watched pages."""
+    round_timer.touch(change["latest_created"])  # The newest row restarts the round countdown
+    queue_feed.apply(change)
+
+    points = change["points"]
+    if isinstance(points, dict):
+        points = PointsInfo(**points)  # Relayed from another worker
+    points_feed.publish(points)
+    dashboard.changed(change, points)
+
+
+@relay.handler
+def emit_to_room(event, payload, room):
+    broadcaster.emit(event, payload, to=room)
+
+
+def emit_settlement(results):
+    """Notify the front-end about a batch of committed submissions."""
+    queue_feed.settlement(results)
+
+    balances = {result["user_id"]: result["point_balance"] for result in results}
+    settlers = {result["user_id"] for result in results if result["settled"]}
+
+    for user_id in settlers:
+        # Emit the user's latest 5 paid out bubbles
+        updated_user_history = get_user_history(user_id)
+        relay.call("emit_to_room", "update_user_history", {
+            "history": serialize_history(updated_user_history)
+        }, user_id)  # Emits only to the specific user
+
+    for user_id, point_balance in balances.items():
+        # Emit an event to update the user's points balance in real-time
+        relay.call("emit_to_room", "update_point_balance", {
+            "point_balance": point_balance
+        }, user_id)  # Emits only to the specific user
+        print(f"Emitting update to room: {user_id} with new balance: {point_balance}")
+
+
+class SettlementTimeout(TimeoutError):
+    """A settlement outlived SETTLEMENT_TIMEOUT but is still queued on the writer, so it may yet commit.
+
+    finish, when set, waits for the writer and returns the result the request would have had.
+    """
+
+    def __init__(self):
+        super().__init__("Timed out waiting for the settlement writer")
+        self.futures = []
+        self.finish = None
+
+
+def wait_for_settlement(future):
+    """Wait for a result from the settlement writer, at most SETTLEMENT_TIMEOUT seconds."""
+    try:
+        return future.get(timeout=app.config["SETTLEMENT_TIMEOUT"])
+    except gevent.Timeout:
+        raise SettlementTimeout()
+
+
+class SettlementWriter:
+    """Single writer that applies every submission, one batch at a time.
+
+    Request handlers push submissions onto a queue and wait on a future. The
+    writer greenlet drains whatever arrives within SETTLEMENT_BATCH_WINDOW,
+    applies the batch in one database transaction, broadcasts once and then
+    hands each caller its own result. Reading and writing the pool from a
+    single greenlet also removes lost updates between concurrent requests.
+    """
+
+    def __init__(self):
+        self.submissions = gevent.queue.Queue()
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            socketio.start_background_task(target=self.run)
+
+    def submit(self, user_id, points):
+        """Queue one submission and wait for its settlement result."""
+        return self.submit_many(user_id, [points])[0]
+
+    def submit_many(self, user_id, points_list):
+        """Queue several submissions so that they settle in the same batch."""
+        self.start()
+        futures = []
+        for points in points_list:
+            future = gevent.event.AsyncResult()
+            self.submissions.put((user_id, points, future))
+            futures.append(future)
+
+        # Hand the caller's pooled connection back while it waits, otherwise enough
+        # waiting requests leave the writer without a connection to settle them with.
+        # This also expires the caller's objects, so they reload the settled balances.
+        db.session.rollback()
+        try:
+            return [wait_for_settlement(future) for future in futures]
+        except SettlementTimeout as e:
+            e.futures = futures
+            raise
+
+    def run_job(self, job):
+        """Run job() on the writer, between batches, and return its result."""
+        self.start()
+        future = gevent.event.AsyncResult()
+        self.submissions.put((None, job, future))
+        return wait_for_settlement(future)
+
+    def run(self):
+        try:
+            while True:
+                self.run_once()
+        finally:
+            self.running = False  # The next submission starts a new writer
+
+    def run_once(self):
+        """Collect and apply one batch, then run the job that ended it, if any."""
+        item = self.submissions.get()
+        batch = []
+        job = None
+        deadline = time.monotonic() + app.config["SETTLEMENT_BATCH_WINDOW"]
+        while True:
+            if item[0] is None:
+                job = item  # Jobs run on their own after the batch collected so far
+                break
+            batch.append(item)
+            if len(batch) >= app.config["SETTLEMENT_MAX_BATCH"]:
+                break
+            try:
+                item = self.submissions.get(timeout=max(deadline - time.monotonic(), 0))
+            except gevent.queue.Empty:
+                break
+
+        with app.app_context():
+            try:
+                if batch:
+                    self.apply(batch)
+                if job:
+                    self.apply_job(job)
+            except Exception as e:
+                # Nobody may be left waiting: fail whatever did not get a result
+                print(f"Error in the settlement writer: {e}")
+                db.session.rollback()
+                for user_id, points, future in batch + ([job] if job else []):
+                    if not future.ready():
+                        future.set_exception(e)
+            finally:
+                db.session.remove()
+
+    def apply_job(self, item):
+        user_id, job, future = item
+        try:
+            result = job()
+        except Exception as e:
+            db.session.rollback()
+            future.set_exception(e)
+        else:
+            future.set(result)
+
+    def apply(self, batch):
+        """Apply a batch in one transaction, or one by one if the batch fails."""
+        try:
+            lock_pool()
+            results = [self.apply_one(user_id, points) for user_id, points, future in batch]
+            db.session.commit()
+        except Exception as e:
+            print(f"Error applying settlement batch, retrying one by one: {e}")
+            db.session.rollback()
+            results = []
+            for user_id, points, future in batch:
+                try:
+                    lock_pool()
+                    result = self.apply_one(user_id, points)
+                    db.session.commit()
+                except Exception as e:
+                    print(f"Error inserting row into dublbubl: {e}")
+                    db.session.rollback()
+                    result = e
+                results.append(result)
+
+        # Read each user's balance once the batch is committed. The batch stays committed whatever
+        # happens from here on, so a failed read keeps the balance apply_submission() left in the result.
+        users = {}
+        for result in results:
+            if isinstance(result, dict) and "error" not in result:
+                try:
+                    user = users.setdefault(result["user_id"], db.session.get(Users, result["user_id"]))
+                    result["point_balance"] = get_point_balance(user)
+                except Exception as e:
+                    print(f"Error reading balance after settlement: {e}")
+                    db.session.rollback()
+
+        committed = [result for result in results if isinstance(result, dict) and "error" not in result]
+        if committed:
+            try:
+                emit_settlement(committed)
+            except Exception as e:
+                print(f"Error emitting settlement: {e}")
+
+        for (user_id, points, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set(result)
+
+    def apply_one(self, user_id, points):
+        user = db.session.get(Users, user_id)
+        if user is None:
+            return {"user_id": user_id, "error": "User not found"}
+
+        # Ensure user has enough points
+        if get_point_balance(user) < points:
+            return {"user_id": user_id, "error": "Not enough points"}
+
+        return apply_submission(user, points)
+
+
+settlement_writer = SettlementWriter()
+
+
+def lock_pool():
+    """Lock the points_tracker row, so transactions that move the pool run one at a time across workers.
+
+    Each worker has its own settlement writer. On SQLite, which only has one
+    writer at a time anyway, no lock is taken.
+    """
+    if bubble_queue is None:
+        db.session.execute(select(PointsTracker.tracker_id).with_for_update()).all()
+
+
+class IdempotencyCache:
+    """Bounded, expiring cache of recent submission results by idempotency key.
+
+    A key is claimed before its submission settles, so a retry that arrives
+    while the first attempt is still in flight waits for that result instead
+    of settling a second time. Every entry lives for the same TTL, which keeps
+    insertion order equal to expiry order.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # (user_id, key) -> (expires_at, future)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.entries and next(iter(self.entries.values()))[0] <= now:
+            self.entries.popitem(last=False)
+
+    def claim(self, user_id, key):
+        """Return (future, True) for a new key, or (existing future, False) for a duplicate."""
+        self.expire()
+        entry = self.entries.get((user_id, key))
+        if entry is not None:
+            return entry[1], False
+
+        future = gevent.event.AsyncResult()
+        self.entries[(user_id, key)] = (time.monotonic() + self.ttl, future)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)  # Evict the oldest key
+        return future, True
+
+    def result(self, user_id, key):
+        """The stored result for a key, waiting if it is still settling, or None if unknown."""
+        self.expire()
+        entry = self.entries.get((user_id, key))
+        return wait_for_settlement(entry[1]) if entry is not None else None
+
+    def release(self, user_id, key):
+        """Forget a key whose submission failed so that it can be retried."""
+        self.entries.pop((user_id, key), None)
+
+
+idempotency_cache = IdempotencyCache(app.config["IDEMPOTENCY_CACHE_SIZE"], app.config["IDEMPOTENCY_TTL"])
+
+
+def run_idempotent(user_id, key, settle):
+    """Run settle() once per idempotency key and return its result to every duplicate.
+
+    settle() returns (payload, status) whichever endpoint calls it, so the form
+    and the API can replay each other's results for the same key. A server
+    error or an exception means the submission rolled back: it is handed to
+    duplicates already waiting but not kept, so a retry settles again. A
+    timeout is different, the writer may still commit, so the key stays
+    claimed and gets the result once the writer has it. Returns a tuple of
+    (result, whether it was replayed from the cache).
+    """
+    if not key:
+        return settle(), False
+
+    future, created = idempotency_cache.claim(user_id, key)
+    if not created:
+        return wait_for_settlement(future), True
+
+    try:
+        result = settle()
+    except SettlementTimeout as e:
+        if e.finish is None:
+            idempotency_cache.release(user_id, key)
+            future.set_exception(e)
+        else:
+            socketio.start_background_task(finish_idempotent, user_id, key, future, e.finish)
+        raise
+    except Exception as e:
+        idempotency_cache.release(user_id, key)
+        future.set_exception(e)
+        raise
+    future.set(result)
+    if result[1] >= 500:
+        idempotency_cache.release(user_id, key)
+    return result, False
+
+
+def finish_idempotent(user_id, key, future, finish):
+    """Store the result of a settlement that timed out under its key once the writer settles it."""
+    with app.app_context():
+        try:
+            result = finish()
+        except Exception as e:
+            print(f"Error finishing settlement for idempotency key {key}: {e}")
+            idempotency_cache.release(user_id, key)
+            future.set_exception(e)
+        else:
+            future.set(result)
+            if result[1] >= 500:
+                idempotency_cache.release(user_id, key)
+        finally:
+            db.session.remove()
+
+
+def get_settlement_error(result):
+    """The first error in a (payload, status) settlement result, or None if it all settled."""
+    payload, status = result
+    if "error" in payload:
+        return payload["error"]
+    errors = [item["error"] for item in payload["results"] if item["status"] != "ok"]
+    return errors[0] if errors else None
+
+
+def get_idempotency_key(value):
+    """Normalise a client supplied idempotency key, ignoring unusable values."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if 0 < len(value) <= 255 else None
+
+
+# A queued dublbubl row held by the in-memory queue engine
+QueueEntry = namedtuple("QueueEntry", ["row_id", "user_id", "username", "points_in", "points_out", "date_created", "running_total"])
+
+# A paid out row that the in-memory queue engine has not written to dublbubl_history yet
+HistoryRow = namedtuple("HistoryRow", ["row_id", "points_in", "points_out", "date_created", "date_archived"])
+
+
+class PrefixIndex:
+    """Running totals of points_out in queue order, mirroring dublbubl.running_total.
+
+    Appending at the tail and popping at the head are O(1) (amortized), and
+    both payout questions bisect the totals in O(log n).
+    """
+
+    def __init__(self):
+        self.row_ids = []
+        self.totals = []
+        self.head = 0  # Position of the queue head in row_ids and totals
+        self.base = 0  # Running total of every row paid out before the head
+
+    def __len__(self):
+        return len(self.totals) - self.head
+
+    def tail_total(self):
+        return self.totals[-1] if len(self) else 0
+
+    def append(self, row_id, running_total):
+        self.row_ids.append(row_id)
+        self.totals.append(running_total)
+
+    def popleft(self, count=1):
+        self.head += count
+        self.base = self.totals[self.head - 1]
+        if not len(self):
+            self.clear()
+        elif self.head > 1024 and self.head * 2 > len(self.totals):
+            # Drop the paid out prefix once it makes up most of the lists
+            del self.row_ids[:self.head]
+            del self.totals[:self.head]
+            self.head = 0
+
+    def clear(self):
+        self.row_ids = []
+        self.totals = []
+        self.head = 0
+        self.base = 0
+
+    def count_through(self, row_id):
+        """Number of queued rows with a row_id up to and including row_id."""
+        return bisect_right(self.row_ids, row_id, self.head) - self.head
+
+    def rows_cleared_by(self, pool):
+        """Number of rows from the head that a pool of this size pays out."""
+        return bisect_right(self.totals, self.base + pool, self.head) - self.head
+
+    def points_until(self, row_id, pool):
+        """Points still needed on top of the pool until row_id pays out, or None if it is not queued."""
+        position = bisect_left(self.row_ids, row_id, self.head)
+        if position == len(self.row_ids) or self.row_ids[position] != row_id:
+            return None
+        return max(self.totals[position] - self.base - pool, 0)
+
+
+def apply_journal(ops):
+    """Write a batch of journaled submissions to the database in one transaction.
+
+    Every op holds the row it created, the rows it paid out and the pool left
+    afterwards. Rows are only ever paid out from the head of the queue, so the
+    whole batch collapses into one insert per table, one grouped users update,
+    one range delete and one points_tracker write. The caller commits.
+    """
+    if not ops:
+        return
+
+    history = []
+    points_delta = {}
+    earned_delta = {}
+    last_settled_row_id = None
+    for op in ops:
+        settler = op["settler"]
+        points_delta[settler["id"]] = points_delta.get(settler["id"], 0) - op["row"]["points_in"]
+        for row in op["settled"]:
+            history.append({
+                "user_id": settler["id"],
+                "username": settler["username"],
+                "row_id": row["row_id"],
+                "creator_id": row["user_id"],
+                "creator_username": row["username"],
+                "points_in": row["points_in"],
+                "points_out": row["points_out"],
+                "date_created": row["date_created"],
+                "date_archived": op["date"]
+            })
+            points_delta[row["user_id"]] = points_delta.get(row["user_id"], 0) + row["points_out"]
+            earned_delta[row["user_id"]] = earned_delta.get(row["user_id"], 0) + row["points_out"]
+            last_settled_row_id = row["row_id"]
+
+    # New rows continue the positions of the current queue tail
+    tail_position = db.session.query(Dublbubl.queue_position).order_by(Dublbubl.row_id.desc()).limit(1).scalar() or 0
+    db.session.execute(insert(Dublbubl), [
+        dict(op["row"], queue_position=tail_position + position)
+        for position, op in enumerate(ops, start=1)
+    ])
+    if history:
+        db.session.execute(insert(DublbublHistory), history)
+
+    balances = {"points": func.coalesce(Users.points, 0) + case(points_delta, value=Users.id, else_=0)}
+    if earned_delta:
+        balances["total_points_earned"] = func.coalesce(Users.total_points_earned, 0) + case(earned_delta, value=Users.id, else_=0)
+    db.session.execute(
+        update(Users)
+        .where(Users.id.in_(points_delta))
+        .values(**balances)
+        .execution_options(synchronize_session=False)
+    )
+
+    if last_settled_row_id is not None:
+        db.session.execute(
+            delete(Dublbubl)
+            .where(Dublbubl.row_id <= last_settled_row_id)
+            .execution_options(synchronize_session=False)
+        )
+
+    points_tracker = get_points_tracker(ops[-1]["date"])
+    settled = [row for op in ops for row in op["settled"]]
+    count_queue(
+        points_tracker,
+        len(ops) - len(settled),
+        sum(op["row"]["points_in"] for op in ops) - sum(row["points_in"] for row in settled),
+        sum(op["row"]["points_out"] for op in ops) - sum(row["points_out"] for row in settled)
+    )
+    points_tracker.current_points_in = ops[-1]["pool"]
+    points_tracker.date_created = ops[-1]["tracker_date"]
+
+
+class BubbleQueue:
+    """Authoritative in-memory copy of the dublbubl queue and the points pool.
+
+    Submissions are settled against memory, appended to a journal file and
+    written behind to the database in batches by flush(). On startup the
+    journal is replayed so that no acknowledged submission is lost.
+    History and leaderboard reads trail memory by at most one flush interval.
+    """
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.entries = deque()
+        self.index = PrefixIndex()
+        self.pool = 0
+        self.tracker_date = None
+        self.next_row_id = 1
+        self.pending = []  # Journaled submissions not yet written to the database
+        self.writing = []  # Submissions in the flush that is committing right now
+        self.pending_points = {}  # Unwritten balance changes per user_id
+        self.journal = None
+
+    def load(self):
+        """Replay the journal into the database, then rebuild the queue from it."""
+        self.replay_journal()
+
+        self.entries.clear()
+        self.index.clear()
+        for row in Dublbubl.query.order_by(Dublbubl.row_id.asc()).all():
+            running_total = row.running_total
+            if running_total is None:
+                running_total = self.index.tail_total() + row.points_out
+            self.entries.append(QueueEntry(row.row_id, row.user_id, row.username, row.points_in, row.points_out, row.date_created, running_total))
+            self.index.append(row.row_id, running_total)
+
+        # Running totals carry on from rows paid out before the head, as in settle_queue()
+        head = self.head()
+        if head is not None:
+            self.index.base = head.running_total - head.points_out
+
+        points_tracker = PointsTracker.query.first()
+        self.pool = points_tracker.current_points_in if points_tracker else 0
+        self.tracker_date = points_tracker.date_created if points_tracker else None
+
+        last_row_id = max(
+            db.session.query(func.max(Dublbubl.row_id)).scalar() or 0,
+            db.session.query(func.max(DublbublHistory.row_id)).scalar() or 0
+        )
+        self.next_row_id = last_row_id + 1
+
+        self.journal = open(self.journal_path, "a")
+        print(f"Loaded {len(self.entries)} queued rows into memory, pool {self.pool}")
+
+    def replay_journal(self):
+        """Write journaled submissions that did not reach the database before a restart."""
+        if not os.path.exists(self.journal_path):
+            return
+
+        ops = []
+        with open(self.journal_path) as journal:
+            for line in journal:
+                try:
+                    ops.append(json.loads(line))
+                except ValueError:
+                    print("Skipping incomplete journal entry.")
+
+        # A crash between commit and journal truncation leaves already written ops behind
+        row_ids = [op["row"]["row_id"] for op in ops]
+        written = {row_id for (row_id,) in db.session.query(Dublbubl.row_id).filter(Dublbubl.row_id.in_(row_ids))}
+        written.update(row_id for (row_id,) in db.session.query(DublbublHistory.row_id).filter(DublbublHistory.row_id.in_(row_ids)))
+        ops = [op for op in ops if op["row"]["row_id"] not in written]
+
+        if ops:
+            apply_journal(ops)
+            db.session.commit()
+            print(f"Replayed {len(ops)} journaled submissions.")
+        self.rewrite_journal([])
+
+    def rewrite_journal(self, ops):
+        """Replace the journal with only the ops that are still pending."""
+        if self.journal:
+            self.journal.close()
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, "w") as journal:
+            for op in ops:
+                journal.write(json.dumps(op) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_path, self.journal_path)
+        self.journal = open(self.journal_path, "a")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def head(self):
+        return self.entries[0] if self.entries else None
+
+    def points_required(self):
+        head = self.head()
+        return head.points_out - self.pool if head else 0
+
+    def rows(self, offset, limit):
+        offset = max(offset, 0)
+        return list(islice(self.entries, offset, offset + limit))
+
+    def rows_after(self, after, limit):
+        offset = 0 if after is None else self.index.count_through(after)
+        return self.rows(offset, limit)
+
+    def rows_before(self, before, limit):
+        end = len(self) if before is None else self.index.count_through(before - 1)
+        return self.rows(end - limit, min(limit, end))
+
+    def point_balance(self, user):
+        """The user's balance including changes that have not been written yet."""
+        return (user.points or 0) + self.pending_points.get(user.id, 0)
+
+    def submit(self, user, points):
+        """Settle a submission against memory and journal it for write-behind."""
+        current_date = clock.timestamp()
+
+        points_out = calculate_points_out(points)
+        new_row = QueueEntry(self.next_row_id, user.id, user.username, points, points_out, current_date, self.index.tail_total() + points_out)
+        self.next_row_id += 1
+        self.entries.append(new_row)
+        self.index.append(new_row.row_id, new_row.running_total)
+
+        # Add points_in to the pool only if the queue has more than 1 row
+        pool = self.pool
+        if len(self.entries) > 1:
+            pool += points
+            self.tracker_date = current_date
+
+        settled = [self.entries.popleft() for _ in range(self.index.rows_cleared_by(pool))]
+        if settled:
+            pool -= settled[-1].running_total - self.index.base
+            self.index.popleft(len(settled))
+            self.tracker_date = current_date
+        self.pool = pool
+
+        op = {
+            "settler": {"id": user.id, "username": user.username},
+            "row": new_row._asdict(),
+            "settled": [row._asdict() for row in settled],
+            "pool": pool,
+            "date": current_date,
+            "tracker_date": self.tracker_date or current_date
+        }
+        self.journal.write(json.dumps(op) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+        self.pending.append(op)
+        self.pending_points[user.id] = self.pending_points.get(user.id, 0) - points
+        for row in settled:
+            self.pending_points[row.user_id] = self.pending_points.get(row.user_id, 0) + row.points_out
+
+        return {
+            "user_id": user.id,
+            "row": serialize_row(new_row),
+            "settled": [serialize_row(row) for row in settled],
+            "current_points_in": pool,
+            "point_balance": self.point_balance(user)
+        }
+
+    def pending_history(self, user_id):
+        """The user's paid out rows that are not in dublbubl_history yet, oldest first."""
+        return [
+            HistoryRow(row["row_id"], row["points_in"], row["points_out"], row["date_created"], op["date"])
+            for op in self.writing + self.pending
+            for row in op["settled"] if row["user_id"] == user_id
+        ]
+
+    def flush(self):
+        """Write all pending submissions to the database in one transaction."""
+        if not self.pending:
+            return
+
+        ops, self.pending = self.pending, []
+        self.writing = ops
+        try:
+            apply_journal(ops)
+            db.session.commit()
+        except Exception as e:
+            print(f"Error writing queue to database: {e}")
+            db.session.rollback()
+            self.pending = ops + self.pending
+            return
+        finally:
+            self.writing = []
+
+        for op in ops:
+            settler_id = op["settler"]["id"]
+            self.pending_points[settler_id] = self.pending_points.get(settler_id, 0) + op["row"]["points_in"]
+            for row in op["settled"]:
+                self.pending_points[row["user_id"]] = self.pending_points.get(row["user_id"], 0) - row["points_out"]
+        self.pending_points = {user_id: delta for user_id, delta in self.pending_points.items() if delta}
+        self.rewrite_journal(self.pending)
+
+    def reset(self):
+        """Empty the queue and the pool when the round expires."""
+        self.flush()
+        self.entries.clear()
+        self.index.clear()
+        self.pool = 0
+
+
+def write_behind():
+    """Background task that flushes the in-memory queue to the database."""
+    while True:
+        time.sleep(app.config["WRITE_BEHIND_INTERVAL"])
+        with app.app_context():
+            bubble_queue.flush()
+            db.session.remove()
+
+
+def flush_on_exit():
+    with app.app_context():
+        bubble_queue.flush()
 
-                # Reset current_points_in to 0 in points_tracker table
-                session.query(PointsTracker).update({"current_points_in": 0})
-                session.commit()
 
-                # Emit an empty table to the front-end
-                socketio.emit("update_table", {"rows": []})  # Notify frontend of table reset
+def get_user_history(user_id, limit=5):
+    """The user's latest paid out bubbles, newest first, including payouts not written behind yet."""
+    rows = DublbublHistory.query.filter_by(creator_id=user_id).order_by(DublbublHistory.row_id.desc()).limit(limit).all()
+    if bubble_queue is not None:
+        # A row can be in both while a flush commits, so keep one copy per row_id
+        rows = list({row.row_id: row for row in rows + bubble_queue.pending_history(user_id)}.values())
+        rows = sorted(rows, key=lambda row: row.row_id, reverse=True)[:limit]
+    return rows
 
-                # Emit the reset points to the frontend
-                socketio.emit("update_points", {"current_points_in": 0})  # Notify frontend of points reset
 
-                # Emit real-time update for current_points_in and points_in_required
-                current_points_in = session.query(PointsTracker).with_entities(PointsTracker.current_points_in).first()
-                points_in_required = 0  # Default value 
+def get_queue_rows(offset, limit):
+    """Fetch up to limit queue rows, starting offset rows after the head."""
+    if limit <= 0:
+        return []
+    if bubble_queue is not None:
+        return bubble_queue.rows(offset, limit)
+    return Dublbubl.query.order_by(Dublbubl.row_id.asc()).offset(offset).limit(limit).all()
 
-                if current_points_in is None or points_in_required is None:
-                    print("Error: current_points_in or points_in_required is None.")
-                    points_in_required = 0  # Default value
 
-                print(f"Emitting points info: {current_points_in[0]}, {points_in_required}")
-                socketio.emit("update_points_info", {
-                    "current_points_in": current_points_in[0],  # Emitting the actual points_in value
-                    "points_in_required": points_in_required  # Emitting the calculated points_in_required
-                })  # Broadcasts to all connected clients
+def get_queue_rows_after(after, limit):
+    """Fetch up to limit queue rows with a row_id above after, oldest first; from the head when after is None."""
+    if bubble_queue is not None:
+        return bubble_queue.rows_after(after, limit)
+    query = Dublbubl.query
+    if after is not None:
+        query = query.filter(Dublbubl.row_id > after)
+    return query.order_by(Dublbubl.row_id.asc()).limit(limit).all()
 
-                # Reset the timer_running flag to allow starting the timer again
-                timer_running = False
 
-                break  # Exit the loop and reset the process
+def get_queue_rows_before(before, limit):
+    """Fetch the last limit queue rows with a row_id below before, oldest first; from the tail when before is None."""
+    if bubble_queue is not None:
+        return bubble_queue.rows_before(before, limit)
+    query = Dublbubl.query
+    if before is not None:
+        query = query.filter(Dublbubl.row_id < before)
+    return query.order_by(Dublbubl.row_id.desc()).limit(limit).all()[::-1]
 
-            # Check if a new row has been added, and update the timestamp if necessary
-            last_row = session.query(Dublbubl).with_entities(Dublbubl.date_created).order_by(Dublbubl.row_id.desc()).first()
-            if last_row:
-                # Parse the date from the database and make it timezone-aware if it's naive
-                new_last_timestamp = datetime.datetime.strptime(last_row[0], "%Y-%m-%d %H:%M:%S")
 
-                # Make sure new_last_timestamp is timezone-aware
-                if new_last_timestamp.tzinfo is None:
-                    new_last_timestamp = new_last_timestamp.replace(tzinfo=datetime.timezone.utc)
+def get_queue_page(after):
+    """Fetch the rows of the page that follows after, and whether any rows come after them."""
+    rows = get_queue_rows_after(after, ROWS_PER_PAGE + 1)
+    return rows[:ROWS_PER_PAGE], len(rows) > ROWS_PER_PAGE
 
-                if new_last_timestamp > last_timestamp:
-                    last_timestamp = new_last_timestamp
-                    continue  # A new row has been added, restart the timer
 
-        # Close the thread-specific connection
-        session.remove()
+def find_page_before(before):
+    """The cursor of the page that ends just before the row before, or None for the head page.
 
-        time.sleep(1)  # Sleep briefly before restarting the loop
+    With before None this is the last page.
+    """
+    rows = get_queue_rows_before(before, ROWS_PER_PAGE + 1)
+    return rows[0].row_id if len(rows) > ROWS_PER_PAGE else None
 
-# Start countdown timer using background task
+
+def get_queue_length():
+    """Number of rows waiting in the queue, from the counter kept on points_tracker."""
+    if bubble_queue is not None:
+        return len(bubble_queue)
+    return db.session.query(PointsTracker.queue_length).scalar() or 0
+
+
+def count_pages(total_rows):
+    return (total_rows + ROWS_PER_PAGE - 1) // ROWS_PER_PAGE  # Round up
+
+
+def get_point_balance(user):
+    """The user's spendable point balance."""
+    if bubble_queue is not None:
+        return bubble_queue.point_balance(user)
+    return user.points if user.points else 0  # Default to 0 if no points exist
+
+
+def get_queue_head():
+    """The oldest queued row, which is the next one to pay out."""
+    if bubble_queue is not None:
+        return bubble_queue.head()
+    return Dublbubl.query.order_by(Dublbubl.row_id.asc()).first()
+
+
+def get_points_info():
+    """Current pool and the points still needed to pop the queue head."""
+    if bubble_queue is not None:
+        return PointsInfo(bubble_queue.pool, bubble_queue.points_required())
+
+    current_points_in = db.session.query(PointsTracker.current_points_in).scalar() or 0
+    head = db.session.query(Dublbubl.points_out).order_by(Dublbubl.row_id.asc()).first()
+    return PointsInfo(current_points_in, head.points_out - current_points_in if head else 0)
+
+
+# Load the in-memory queue engine if it is enabled
+bubble_queue = None
+if app.config["BUBBLE_ENGINE"] == "memory" and relay.enabled:
+    raise RuntimeError("BUBBLE_ENGINE=memory keeps the queue in one process and cannot run with several workers")
+if app.config["BUBBLE_ENGINE"] == "memory":
+    bubble_queue = BubbleQueue(app.config["BUBBLE_JOURNAL"])
+    with app.app_context():
+        bubble_queue.load()
+    socketio.start_background_task(target=write_behind)
+    atexit.register(flush_on_exit)
+
+
+# Seconds without a new bubble before the round expires
+ROUND_LENGTH = app.config['ROUND_LENGTH']
+
+
+def parse_date(date_created):
+    """Parse a stored date_created string as a UTC datetime."""
+    return datetime.datetime.strptime(date_created, "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+
+
+def get_latest_created():
+    """date_created of the newest queued row, or None if the queue is empty."""
+    if bubble_queue is not None:
+        return bubble_queue.entries[-1].date_created if len(bubble_queue) else None
+    last_row = db.session.query(Dublbubl.date_created).order_by(Dublbubl.row_id.desc()).first()
+    return last_row[0] if last_row else None
+
+
+def serialize_round(archived):
+    """Convert a rounds row into the payload broadcast when the round ends."""
+    return {
+        "round_id": archived.round_id,
+        "started_at": archived.started_at,
+        "ended_at": archived.ended_at,
+        "total_rows": archived.total_rows,
+        "volume": archived.volume,
+        "rows_paid": archived.rows_paid,
+        "points_paid": archived.points_paid,
+        "rows_forfeited": archived.rows_forfeited,
+        "points_forfeited": archived.points_forfeited,
+        "pool_forfeited": archived.pool_forfeited
+    }
+
+
+def expire_round():
+    """Archive the unpaid queue and reset the pool once the round deadline has passed.
+
+    Everything happens in one transaction: the aggregates are read in a single
+    query, the remaining queue is copied into round_rows with one
+    INSERT ... SELECT, and then the queue is cleared and the pool reset.
+    The queue is emptied at the end of every round, so the rows paid out
+    during this round are exactly the history rows archived after the
+    previous round ended: those above its last_history_id, a range of the
+    primary key.
+    """
+    if bubble_queue is not None:
+        bubble_queue.flush()  # The archive is read from the database
+
+    lock_pool()
+    ended_at = clock.timestamp()
+    previous = select(Rounds.ended_at, Rounds.last_history_id).order_by(Rounds.round_id.desc()).limit(1)
+    started_at = func.coalesce(previous.with_only_columns(Rounds.ended_at).scalar_subquery(), "")
+    previous_history_id = func.coalesce(previous.with_only_columns(Rounds.last_history_id).scalar_subquery(), 0)
+    last_history_id = func.coalesce(select(func.max(DublbublHistory.history_id)).scalar_subquery(), 0)
+    paid = select(
+        func.count().label("rows"),
+        func.coalesce(func.sum(DublbublHistory.points_in), 0).label("points_in"),
+        func.coalesce(func.sum(DublbublHistory.points_out), 0).label("points_out")
+    ).where(DublbublHistory.history_id > previous_history_id).subquery()
+    forfeited = select(  # Every row still queued, from the counters on points_tracker
+        func.coalesce(func.sum(PointsTracker.queue_length), 0).label("rows"),
+        func.coalesce(func.sum(PointsTracker.queued_points_in), 0).label("points_in"),
+        func.coalesce(func.sum(PointsTracker.queued_points_out), 0).label("points_out")
+    ).subquery()
+    pool = select(func.coalesce(func.sum(PointsTracker.current_points_in), 0)).scalar_subquery()
+    stats = db.session.execute(select(
+        started_at.label("started_at"),
+        last_history_id.label("last_history_id"),
+        paid.c.rows.label("rows_paid"), paid.c.points_in.label("paid_in"), paid.c.points_out.label("points_paid"),
+        forfeited.c.rows.label("rows_forfeited"), forfeited.c.points_in.label("forfeited_in"), forfeited.c.points_out.label("points_forfeited"),
+        pool.label("pool")
+    ).select_from(paid.join(forfeited, true()))).one()  # Both sides are single aggregate rows
+
+    archived = Rounds(
+        started_at=stats.started_at or None,
+        ended_at=ended_at,
+        total_rows=stats.rows_paid + stats.rows_forfeited,
+        volume=stats.paid_in + stats.forfeited_in,
+        rows_paid=stats.rows_paid,
+        points_paid=stats.points_paid,
+        rows_forfeited=stats.rows_forfeited,
+        points_forfeited=stats.points_forfeited,
+        pool_forfeited=stats.pool,
+        last_history_id=stats.last_history_id
+    )
+    db.session.add(archived)
+    db.session.flush()
+
+    # The broadcast payload comes from this transaction, nothing is re-read after the commit
+    summary = serialize_round(archived)
+
+    # Move the unpaid rows into the archive in bulk
+    db.session.execute(insert(RoundRows).from_select(
+        ["round_id", "row_id", "user_id", "username", "points_in", "points_out", "date_created"],
+        select(literal(archived.round_id), Dublbubl.row_id, Dublbubl.user_id, Dublbubl.username,
+               Dublbubl.points_in, Dublbubl.points_out, Dublbubl.date_created)
+    ))
+    db.session.execute(delete(Dublbubl))
+
+    # Reset current_points_in and the queue counters to 0 in points_tracker table
+    db.session.execute(update(PointsTracker).values(current_points_in=0, queue_length=0, queued_points_in=0, queued_points_out=0))
+    db.session.commit()
+
+    if bubble_queue is not None:
+        bubble_queue.reset()
+
+    relay.call("round_expired", summary)
+    return summary
+
+
+@relay.handler
+def round_expired(summary):
+    """On every worker: announce the archived round, clear the table and pick up the new deadline."""
+    state_stream.publish("round_ended", summary)
+
+    # Emit an empty table to the front-end
+    queue_feed.reset()  # Notify frontend of table reset
+
+    # Emit the reset points to the frontend
+    points_feed.publish(PointsInfo(0, 0))  # Broadcasts to all connected clients
+    dashboard.reset()
+
+    # A row committed right after the expiry may already have started the next round
+    round_timer.reload()
+
+
+def refresh_shared_state():
+    """On this worker: read the queue, pool and deadline again after missing relayed events."""
+    queue_feed.refresh()
+    points_feed.publish(get_points_info())
+    dashboard.reset()
+    round_timer.reload()
+
+
+relay.on_gap = refresh_shared_state
+
+
+def epoch_millis(moment):
+    return int(moment.timestamp() * 1000)
+
+
+class Lease:
+    """Lease on a lock row in the leases table, held by at most one worker process.
+
+    Workers take the lease with a conditional UPDATE that only matches while
+    the row is theirs or has lapsed, which works the same on SQLite and
+    PostgreSQL. The holder renews it every third of the TTL, so if it dies
+    another worker takes over within one TTL. A single worker has nobody to
+    share it with, so an unshared lease is always held and never touches the
+    database.
+    """
+
+    def __init__(self, name, ttl, shared=True):
+        self.name = name
+        self.ttl = ttl
+        self.shared = shared
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self.expires = 0  # time.monotonic() at which our lease lapses, 0 while not held
+        self.on_acquire = None
+        self.renewer = None
+
+    def held(self):
+        return not self.shared or time.monotonic() < self.expires
+
+    def acquire(self):
+        """Take or renew the lease. The caller needs an app context."""
+        if not self.shared:
+            return True
+        started = time.monotonic()
+        now = time.time()
+        claimed = db.session.execute(
+            update(Leases)
+            .where(Leases.name == self.name, or_(Leases.owner == self.owner, Leases.expires_at < now))
+            .values(owner=self.owner, expires_at=now + self.ttl)
+        ).rowcount
+        if not claimed and db.session.get(Leases, self.name) is None:
+            # First worker ever to run creates the lock row
+            db.session.add(Leases(name=self.name, owner=self.owner, expires_at=now + self.ttl))
+            claimed = 1
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Another worker created the row first
+            claimed = 0
+
+        was_held = self.held()
+        self.expires = started + self.ttl if claimed else 0
+        if claimed and not was_held:
+            print(f"Lease {self.name} acquired by {self.owner}")
+            if self.on_acquire is not None:
+                self.on_acquire()
+        return bool(claimed)
+
+    def release(self):
+        """Let the lease lapse right away so another worker can take over."""
+        if not self.shared or not self.held():
+            return
+        self.expires = 0
+        db.session.execute(
+            update(Leases).where(Leases.name == self.name, Leases.owner == self.owner).values(expires_at=0)
+        )
+        db.session.commit()
+
+    def start(self, on_acquire=None):
+        if not self.shared:
+            return
+        self.renew()
+        self.on_acquire = on_acquire  # Only takeovers after the first renewal need the callback
+        self.renewer = socketio.start_background_task(target=self.run)
+
+    def renew(self):
+        with app.app_context():
+            try:
+                self.acquire()
+            except Exception as e:
+                print(f"Error renewing lease {self.name}: {e}")
+                db.session.rollback()
+                self.expires = 0
+            finally:
+                db.session.remove()
+
+    def run(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            self.renew()
+
+
+timer_lease = Lease("round_timer", app.config["TIMER_LEASE_TTL"], shared=relay.enabled)
+
+
+def release_timer_lease():
+    with app.app_context():
+        try:
+            timer_lease.release()
+        except Exception as e:
+            print(f"Error releasing lease {timer_lease.name}: {e}")
+
+
+atexit.register(release_timer_lease)
+
+
+class RoundTimer:
+    """Round deadline held in memory and expired by a one-shot scheduled greenlet.
+
+    The deadline is read from the database once on start and then moved
+    forward by the submission path whenever a row is inserted, so the database
+    is only touched on submissions and when the round actually expires.
+    Clients are sent the absolute deadline whenever it changes and count down
+    locally.
+
+    Every worker keeps a deadline for its own clients, but only the worker
+    holding timer_lease expires the round. The others re-read the deadline
+    from the database once theirs has passed.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.deadline = None  # UTC datetime at which the round expires, None while the queue is empty
+        self.expiry = None  # Greenlet scheduled to run at the deadline
+
+    def start(self):
+        if self.started:
+            print("Timer already running.")
+            return
+        self.started = True
+        timer_lease.start(on_acquire=self.reload)
+        self.reload()
+        print("Countdown timer started.")
+
+    def load(self):
+        """Read the deadline implied by the latest queued row."""
+        with app.app_context():
+            try:
+                latest_created = get_latest_created()
+            finally:
+                db.session.remove()
+        if latest_created:
+            return parse_date(latest_created) + datetime.timedelta(seconds=ROUND_LENGTH)
+        return None
+
+    def reload(self):
+        """Pick up the deadline left by the previous owner after taking over the lease."""
+        self.set_deadline(self.load())
+
+    def touch(self, date_created):
+        """Move the deadline forward after a row was inserted at date_created."""
+        deadline = parse_date(date_created) + datetime.timedelta(seconds=ROUND_LENGTH)
+        if self.deadline is None or deadline > self.deadline:
+            self.set_deadline(deadline)
+
+    def set_deadline(self, deadline):
+        self.deadline = deadline
+        if self.expiry is not None:
+            self.expiry.kill(block=False)
+            self.expiry = None
+        if deadline is not None:
+            delay = clock.real_seconds((deadline - clock.now()).total_seconds())
+            self.expiry = gevent.spawn_later(max(delay, 0), self.expire)
+
+        # Clients only hear about the timer when the deadline changes
+        state_stream.publish("update_timer", self.state())
+
+    def state(self):
+        """Deadline and server time in epoch milliseconds, so clients can correct for clock skew.
+
+        speed is the clock speed, so clients count down as fast as the server does.
+        """
+        return {
+            "deadline": epoch_millis(self.deadline) if self.deadline else None,
+            "server_time": epoch_millis(clock.now()),
+            "speed": clock.speed
+        }
+
+    def remaining(self):
+        """Whole seconds left in the round, 0 when there is no running round."""
+        if self.deadline is None:
+            return 0
+        return int((self.deadline - clock.now()).total_seconds())
+
+    def expire(self):
+        """Runs once at the deadline and expires the round through the settlement writer."""
+        self.expiry = None
+        if not timer_lease.held():
+            self.follow()
+            return
+        try:
+            settlement_writer.run_job(self.expire_if_due)
+        except Exception as e:
+            print(f"Error expiring round: {e}")
+
+    def follow(self):
+        """On a worker without the lease, re-read the deadline once ours has passed."""
+        try:
+            deadline = self.load()
+        except Exception as e:
+            print(f"Error reading round deadline: {e}")
+            deadline = self.deadline
+        if deadline is not None and deadline <= clock.now():
+            # The lease holder has not expired the round yet, look again shortly
+            self.expiry = gevent.spawn_later(timer_lease.ttl / 3, self.expire)
+            return
+        self.set_deadline(deadline)
+
+    def expire_if_due(self):
+        latest_created = get_latest_created()
+        if not latest_created:
+            # Already expired, by another worker or by catch_up_rounds()
+            self.set_deadline(None)
+            return
+
+        # A row committed by another process may have pushed the deadline back
+        deadline = parse_date(latest_created) + datetime.timedelta(seconds=ROUND_LENGTH)
+        if deadline > clock.now():
+            self.set_deadline(deadline)
+            return
+
+        print("Round deadline passed with no new row. Clearing dublbubl table.")
+        expire_round()  # Every worker reloads its deadline in round_expired()
+
+
+round_timer = RoundTimer()
+
+
+def catch_up_rounds():
+    """Expire a round whose deadline passed while no worker was running.
+
+    Runs when the app is imported, before the worker serves any request, so
+    the first visitor does not pay for the expiry. The queue only ever holds
+    one round, and it is only expired while it still has rows whose deadline
+    has passed, so running this again after a restart does nothing. When
+    several workers start together only the one that takes the timer lease
+    expires it.
+    """
+    with app.app_context():
+        try:
+            latest_created = get_latest_created()
+            if not latest_created:
+                return
+            deadline = parse_date(latest_created) + datetime.timedelta(seconds=ROUND_LENGTH)
+            if deadline > clock.now():
+                return
+            if not timer_lease.acquire():
+                print("Round deadline passed while the server was down. The worker holding the timer lease will expire it.")
+                return
+            print("Round deadline passed while the server was down. Expiring it before serving requests.")
+            expire_round()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error catching up on expired rounds: {e}")
+        finally:
+            db.session.remove()
+
+
+relay.start()
+catch_up_rounds()
+round_timer.start()  # Own the lease and schedule expiry before serving, even if no page is ever loaded
+
+
+# Start the countdown timer
 def start_timer():
-    global timer_running
-    if not timer_running:
-        socketio.start_background_task(target=countdown_timer)   # Start the countdown in the background
-        timer_running = True # Set the flag to True, indicating the timer is running
-        print("Countdown timer background task started.")
-    else:
-        print("Timer already running.")
+    round_timer.start()
 
 
 @socketio.on('get_timer_state')
 def get_timer_state():
-    # Retrieve the current remaining time from the database or timer state
-    with app.app_context():  # Push the app context for this background task
-        Session = scoped_session(sessionmaker(bind=db.engine))  # Create a scoped session for the thread
-        
-    session = Session()  # Access the session for that thread
+    """Reply to the requesting socket only, from the deadline held in memory."""
+    # The deadline is loaded from the database once, when the timer starts
+    if not round_timer.started:
+        round_timer.start()
+    emit('initial_timer_state', round_timer.state())
 
-    last_row = session.query(Dublbubl).with_entities(Dublbubl.date_created).order_by(Dublbubl.row_id.desc()).first()
 
-    if last_row:
-        last_timestamp = datetime.datetime.strptime(last_row[0], "%Y-%m-%d %H:%M:%S")
+def get_requested_cursor(data):
+    """The after cursor of the page a client shows, None for the head page."""
+    after = data.get("after") if isinstance(data, dict) else None
+    return after if type(after) is int and after >= 0 else None
 
-        # Make sure last_timestamp is timezone-aware
-        if last_timestamp.tzinfo is None:
-            last_timestamp = last_timestamp.replace(tzinfo=datetime.timezone.utc)
 
-        # Get the current time in UTC
-        current_time = datetime.datetime.now(datetime.timezone.utc)
-        
-        remaining_time = 86400 - int((current_time - last_timestamp).total_seconds()) # 86400 seconds = 24 hours
-        hours, remainder = divmod(remaining_time, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        formatted_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}" if remaining_time > 0 else "00:00:00"
+def stream_catch_up(data, channel, after):
+    """Replay the broadcasts a client missed on a channel, or a snapshot if they are no longer buffered."""
+    reply = {"stream": state_stream.stream_id, "channel": channel}
+    events = state_stream.since(data.get("stream"), data.get("since"), channel)
+    if events is not None:
+        reply["events"] = events
     else:
-        formatted_time = "00:00:00"  # Default if no rows exist
+        # Read the seq first, so broadcasts sent meanwhile are applied on top
+        reply["snapshot"] = {"seq": state_stream.seq(channel)}
+        if channel == STATE_CHANNEL:
+            reply["snapshot"]["points"] = get_points_info()
+            reply["snapshot"]["total_pages"] = count_pages(get_queue_length())
+        else:
+            reply["snapshot"]["queue"] = queue_feed.snapshot(after)
+    if channel == STATE_CHANNEL:
+        reply["timer"] = round_timer.state()
+    return reply
 
-    # Emit the initial timer state to the front-end
-    socketio.emit('initial_timer_state', {'time': formatted_time})
 
+@socketio.on('watch_page')
+def watch_page(data=None):
+    """Move the client into the room of the queue page it shows, and catch it up on that page."""
+    data = data if isinstance(data, dict) else {}
+    after = get_requested_cursor(data)
+    page_rooms.watch(request.sid, after)
+    emit('resync', stream_catch_up(data, queue_page_room(after), after))
 
 
+@socketio.on('resync')
+def resync(data=None):
+    """Catch a client up on the shared state channel or on the channel of its page."""
+    data = data if isinstance(data, dict) else {}
+    after = get_requested_cursor(data)
+    channel = STATE_CHANNEL if data.get("channel") == STATE_CHANNEL else queue_page_room(after)
+    emit('resync', stream_catch_up(data, channel, after))
 
 
-# Example Flask route to start the timer
 @app.route("/start_timer")
 def trigger_timer():
     start_timer()
     return "Timer started."
 
 
+@app.route("/api/stats")
+def broadcast_stats():
+    """Counters of the broadcasts coalesced, held back and dropped on this worker."""
+    return {"broadcasts": broadcaster.stats(), "slow_clients": slow_clients.stats()}
+
+
 @app.after_request
 def after_request(response):
     """Ensure responses aren't cached"""
@@ -328,47 +2533,52 @@ def on_connect():
         print(f"User {user_id} joined room")
 
 
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    page_rooms.leave(request.sid)
+    slow_clients.forget(request.sid)
+
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
 
+    # A retried form post whose idempotency key already settled goes straight back to the dashboard
+    if request.method == "POST" and session.get("user_id"):
+        idempotency_key = get_idempotency_key(request.form.get("idempotency_key"))
+        try:
+            result = idempotency_cache.result(session["user_id"], idempotency_key) if idempotency_key else None
+        except Exception:
+            result = None  # Failed or still settling; run_idempotent() below sorts out which
+        if result is not None:
+            error = get_settlement_error(result)
+            if error:
+                flash(error, "danger")
+            else:
+                flash("Bubble created successfully!", "success")
+            return redirect(url_for("index", after=request.form.get("after", type=int)))
+
     updated_rows = []  # Initialize with an empty list
     # Start the timer when the user accesses the index
     start_timer()
 
     try:
         with current_app.app_context():  # Ensure we are in the app context for DB operations
-            # Check database for dublbubl table
-            # dublbubl = cur.execute("SELECT * FROM dublbubl").fetchall()
-            dublbubl = Dublbubl.query.all()
-
-            # Get current page number from query parameters, default to 1
-            page = request.args.get("page", 1, type=int)
-            print(f"📢 Page received in request: {page}")  # Debugging output
+            # Pages are addressed by row_id cursor: ?after=N, ?before=N or ?last=1, the head page by default
+            after = get_requested_cursor({"after": request.args.get("after", type=int)})
+            if "before" in request.args or "last" in request.args:
+                after = find_page_before(request.args.get("before", type=int))
+            print(f"📢 Page received in request: after {after}")  # Debugging output
             print(f"Request URL: {request.url}")
             print(f"Request Args: {request.args}")
 
-            rows_per_page = 20  # Limit rows per page
-            offset = (page - 1) * rows_per_page  # Calculate offset
-
-            # Fetch limited rows based on pagination
-            dublbubl = Dublbubl.query.order_by(Dublbubl.row_id.asc()).offset(offset).limit(rows_per_page).all()
+            # Rows and points info come from the dashboard read model,
+            # each as of the point of the state stream it was read at
+            stream_seq, points_info = dashboard.read_summary()
+            page_seq, dublbubl, more = dashboard.read_page(after)
 
-            # Get total row count to calculate total pages
-            total_rows = Dublbubl.query.count()
-            total_pages = (total_rows + rows_per_page - 1) // rows_per_page  # Round up
-
-
-
-            # Fetch current points_in from points_tracker
-            current_points_in = PointsTracker.query.with_entities(PointsTracker.current_points_in).first()
-
-
-            # Fetch the oldest row's points_out
-            oldest_row_points_out = Dublbubl.query.with_entities(Dublbubl.points_out) \
-                .order_by(Dublbubl.row_id.asc()).first()
-
-        
+            current_points_in = (points_info.current_points_in,)
+            points_in_required = points_info.points_in_required
 
             # Check if user is logged in
             user_id = session.get("user_id")
@@ -378,7 +2588,7 @@ def index():
                 # Fetch the user details
                 user = Users.query.get(user_id)
                 # Fetch the last 5 user's dublbubl history
-                user_history = DublbublHistory.query.filter_by(creator_id=user_id).order_by(DublbublHistory.row_id.desc()).limit(5).all()
+                user_history = get_user_history(user_id)
             else:
                 user = None
                 user_history = None
@@ -387,24 +2597,10 @@ def index():
         print("Error: dublbubl_history table does not exist, creating it.")
         init_db()
 
-    # Handle None values for current_points_in and oldest_row_points_out
-    if current_points_in is None or oldest_row_points_out is None:
-        print("Error: current_points_in or oldest_row_points_out is None.")
-        points_in_required = 0  # Default value
-    else:
-        # Perform the calculation only if both values are valid
-        points_in_required = oldest_row_points_out[0] - current_points_in[0]
-        
-
-
-    # Emit real-time update for current_points_in and points_in_required
-    socketio.emit("update_points_info", {
-        "current_points_in": current_points_in[0] if current_points_in else 0,  # Emitting the actual points_in value
-        "points_in_required": points_in_required  # Emitting the calculated points_in_required
-    })  # Broadcasts to all connected clients
+    # Connected clients get points info from points_feed when a batch or an expiry changes it;
+    # this page renders the current values itself
 
     points = request.form.get("points")
-    current_date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     message = None
     
     if request.method == "POST":
@@ -412,30 +2608,15 @@ def index():
         if user_id is None:
             return render_template("login.html", message="You must be logged in to create a bubble")
         
-        # Check points are entered
-        if not points:
-            flash("No points entered", "danger")  # Use "danger" for errors
-            return redirect(url_for("index"))
-        try:
-            points = int(points)
-        except ValueError:
-            flash("Invalid input", "danger")
-            return redirect(url_for("index"))
-
-        # Check points are positive number
-        if points is None:
-            return "Invalid Input"
-        elif points <= 0 or points > 10000:
-            flash("Points must be between 1 and 10000", "danger")
+        # Check points are entered and within range
+        points, error = parse_points(points)
+        if error:
+            flash(error, "danger")  # Use "danger" for errors
             return redirect(url_for("index"))
     
-        # Create a new session for each request
-        db_session = Session()
-    
         # Check database for user details
         user_id = session.get("user_id")
-        # Fetch the user from the database using SQLAlchemy
-        user = db_session.query(Users).filter(Users.id == user_id).first()
+        user = db.session.get(Users, user_id)
 
         # Check if user is None
         if user is None:
@@ -443,7 +2624,7 @@ def index():
             return redirect(url_for("index"))
         
         # Fetch user's point balance
-        current_points = user.points if user.points else 0  # Default to 0 if no points exist
+        current_points = get_point_balance(user)
         
         # Ensure user has enough points     
         if current_points < points:
@@ -451,339 +2632,20 @@ def index():
             return redirect(url_for("index"))
 
         try:
-            # Calculate the multiplier based on points_in
-            if points >= 10000:
-                points_out = points * 2  # If points are 10,000 or more, multiply by 2
-            elif points >= 5000:
-                points_out = points * 1.75  # If points are 5,000 or more but less than 10,000, multiply by 1.75
-            elif points >= 1000:
-                points_out = points * 1.5  # If points are 1,000 or more but less than 10,000, multiply by 1.5
-            else:
-                points_out = points * 1.25  # Otherwise, points_out equals points_in (e.g., for smaller amounts)
-
-            # Definre current_date
-            current_date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-
-            # Check if a PointsTracker entry exists
-            points_tracker = PointsTracker.query.first()
-
-            if not points_tracker:
-                # If no entry exists, create an initial one
-                points_tracker = PointsTracker(
-                    current_points_in=0,  # Set initial points to 0
-                    date_created=current_date
-                )
-                db.session.add(points_tracker)
-                db.session.commit()  # Commit the new entry
-
-            # Create a new entry in the dublbubl table
-            new_row = Dublbubl(
-                user_id=user.id,
-                username=user.username,
-                points_in=points,
-                points_out=points_out,
-                date_created=current_date
+            result, replayed = run_idempotent(
+                user.id,
+                get_idempotency_key(request.form.get("idempotency_key")),
+                lambda: settle_api_submissions(user.id, [{"points": points}])
             )
-            db.session.add(new_row)
-            db.session.commit()
-            
-            # Fetch all updated rows to send to the front-end
-            # Fetch updated rows
-            updated_rows = Dublbubl.query.order_by(Dublbubl.row_id.asc()).all()
-
-            # Get total row count to calculate total pages
-            # Get the total row count
-            total_rows = Dublbubl.query.count()
-
-            page = request.form.get("page", 1, type=int)
-            print(f"📢 Page received in post request: {page}")  # Debugging output
-            print(f"Request URL: {request.url}")
-            print(f"Request Args: {request.args}")
-            
-            # Calculate the total number of pages
-            total_pages = (total_rows + rows_per_page - 1) // rows_per_page  # Round up
-
-            # Calculate the OFFSET based on the current page
-            offset = (page - 1) * rows_per_page
-
-            # Debugging output
-            print(f"Page: {page}, Rows per page: {rows_per_page}, Offset: {offset}")
-            print(f"Fetching rows starting from: {offset}, Limit: {rows_per_page}")
-
-            # Fetch rows for the current page using LIMIT and OFFSET
-            # Fetch rows for current page
-            updated_rows = Dublbubl.query.order_by(Dublbubl.date_created, Dublbubl.row_id).limit(rows_per_page).offset(offset).all()
-
-            # Serialize Dublbubl objects to dictionaries and remove the internal SQLAlchemy state
-            updated_rows_dict = [
-                {key: value for key, value in row.__dict__.items() if key != '_sa_instance_state'} 
-                for row in updated_rows
-            ]
-
-            # Emit the updated rows along with pagination details
-            socketio.emit("update_table", {
-                "rows": updated_rows_dict,
-                "total_pages": total_pages,
-                "current_page": page
-            })
-
-            # Deduct from total points and update it in the database
-            total_points = current_points - points
-            print(f"total_points: {total_points}")
-
-            # Check total points is not negative
-            if total_points < 0:
-                return "Error: Insufficient points balance."
-
-            # Fetch the user from the database using SQLAlchemy
-            user_to_update = Users.query.get(user.id)  # Assuming `user` is an instance of the `User` model
-            user_to_update.points = total_points
-            db.session.commit()
-
-            # Emit an event to update the user's points balance in real-time (only the point_balance)
-            socketio.emit("update_point_balance", {
-                "point_balance": total_points  # Emitting only the total points balance
-            }, room=user.id)  # Emits only to the specific user
-            print(f"Emitting update to room: {user.id} with new balance: {total_points}")
-
- 
+        except SettlementTimeout:
+            result = ({"error": SETTLEMENT_PENDING_ERROR}, 504)
         except Exception as e:
             print(f"Error inserting row into dublbubl: {e}")
-            db.session.rollback()
-            
-        # Fetch current_points_in value
-        current_points_in = PointsTracker.query.with_entities(PointsTracker.current_points_in).first()
-
-        # Fetch the number of rows in dublbubl
-        row_count = Dublbubl.query.count()
-        print(f"Number of rows in dublbubl: {row_count}")
-
-
-        # Add points_in to points_tracker only if dublbubl has more than 1 row
-        if row_count > 1:
-
-            if current_points_in:
-                new_points_in = current_points_in[0] + points
-                # Retrieve the PointsTracker row itself
-                points_tracker = PointsTracker.query.first()  # Assuming it's a single row and we need to update it
-                points_tracker.current_points_in = new_points_in
-                points_tracker.date_created = current_date
-                db.session.add(points_tracker)
-            else:
-                # Retrieve the PointsTracker row itself
-                points_tracker = PointsTracker.query.first()  # Assuming it's a single row and we need to update it
-                new_entry = PointsTracker(
-                    current_points_in=points,
-                    date_created=current_date
-                )
-                # Add the new entry to the session and commit the transaction
-                db.session.add(new_entry)
-
-            # Commit the changes to the points_tracker database
-            db.session.commit()
-
-        else:
-            # If there is one row, don't update points in points_tracker
-            new_points_in = current_points_in[0] if current_points_in else 0
-            print(f"New points in is { new_points_in }")
-
-
-        oldest_row_points_out = Dublbubl.query.with_entities(Dublbubl.points_out).order_by(Dublbubl.row_id.asc()).first()
-        
-
-
-        # Check if there are no rows or if points_out is None
-        if oldest_row_points_out is None:
-            print("No rows found in dublbubl. Exiting loop.")
-        else:    
-            # Print to debug
-            print(f"Oldest row points out: {oldest_row_points_out[0]}")
-            
-            # If total points added exceed twice the oldest row's points, delete the oldest row
-            while new_points_in >= oldest_row_points_out[0]:
-
-                
-
-                # Get the row ID of the oldest row
-                oldest_row_id = Dublbubl.query.with_entities(Dublbubl.row_id).order_by(Dublbubl.row_id.asc()).first()
-                oldest_row = db_session.query(Dublbubl).order_by(Dublbubl.row_id.asc()).first()
-                if oldest_row:
-                    print(oldest_row.row_id)  # Access the row_id field of the oldest row
-
-
-                # Ensure that oldest_row is not None before checking total points
-                if oldest_row is not None:
-                        # Fetch user's current total points
-                        current_total_points = Users.query.with_entities(Users.total_points_earned).filter(Users.id == oldest_row.user_id).first()
-
-                        if current_total_points is None:
-                            print("No points found for this user.")
-                            current_total_points = 0  # Default to 0 if no value exists
-                        else:
-                            current_total_points = current_total_points[0]  # Extract the value from the tuple
-
-                        print(f"Current total points: {current_total_points}")
-
-                        # Fetch user's point balance only if oldest_row is not None
-                        points = Users.query.with_entities(Users.points).filter(Users.id == oldest_row.user_id).first()
-
-                        if points is None:
-                            print("No points balance found for this user.")
-                            points = 0  # Default to 0 if no value exists
-                        else:
-                            points = points[0]  # Extract the value from the tuple
-
-                        print(f"User's point balance: {points}")
-                else:
-                    print("Oldest row is None, skipping points check.")
-
-                #Insert the oldest row into dublbubl_history
-                if oldest_row:
-                    # Create a new instance of the DublbublHistory model
-                    new_history_entry = DublbublHistory(
-                        user_id=user.id,  # Assuming user.id is the correct field
-                        username=user.username,
-                        row_id=oldest_row.row_id,  # Assuming `oldest_row` is an instance of `Dublbubl`
-                        creator_id=oldest_row.user_id,
-                        creator_username=oldest_row.username,
-                        points_in=oldest_row.points_in,
-                        points_out=oldest_row.points_out,
-                        date_created=oldest_row.date_created,
-                        date_archived=current_date # Adjust if date_archived is set at a different time
-                    )
-                    # Add the new history entry to the session
-                    db_session.add(new_history_entry)
-
-                    # Commit the transaction
-                    db_session.commit()
-
-                    # Fetch the latest 5 history records from all users
-                    updated_user_history = db_session.query(DublbublHistory).filter(DublbublHistory.creator_id == user.id).order_by(DublbublHistory.row_id.desc()).limit(5).all()
-
-                    print(f"Checking user[0]: {user.id}")
-
-                    # Print the user_id and the fetched history to debug
-                    print(f"Fetching history for creator_id: {user.id}")
-                    print("Fetched history:", updated_user_history)
-
-                    # Emit an event to update the user's history in real-time
-                    socketio.emit("update_user_history", {
-                        "history": [
-                            {
-                                "bubble_number": row.row_id, 
-                                "points_invested": row.points_in, 
-                                "points_earned": row.points_out, 
-                                "created_on": row.date_created, 
-                                "archived_on": row.date_archived
-                            } for row in updated_user_history
-                        ]
-                    }, room=user.id)  # Emits only to the specific user
-                    print(f"Emitting update to room: {user.id} with updated user history: {oldest_row.points_out}")
-
-
-
-                    # Add total_points_earned and update it in the database
-                    total_points_earned = current_total_points + oldest_row.points_out
-
-                    # Update total_points_earned for the user
-                    user_to_update = db_session.query(Users).filter(Users.id == oldest_row.user_id).first()
-
-                    if user_to_update:
-                        # Add total_points_earned and update it in the database
-                        user_to_update.total_points_earned = total_points_earned
-
-                        # Add total points and update it in the database
-                        total_points = points + oldest_row.points_out
-                        user_to_update.points = total_points
-                        db_session.commit()  # Commit the changes to the database
-    
-                    # Update current_total_points to reflect new total
-                    current_total_points = total_points_earned
-
-                    updated_total_points = Users.query.with_entities(Users.points).filter(Users.id == user_id).first()
-                    updated_total_points = updated_total_points[0] if updated_total_points else 0
-
-                    # Emit an event to update the user's points balance in real-time
-                    socketio.emit("update_point_balance", {
-                        "point_balance": updated_total_points  # Only emitting the total points balance
-                    }, room=user_id)  # Emits only to the specific user
-                    print(f"Emitting update to room: {user.id} with new balance: {updated_total_points}")
-
-
-                # Check if oldest_row_id is not None before attempting to delete the row
-                if oldest_row_id is not None:
-                    # Fetch the row to delete
-                    row_to_delete = Dublbubl.query.filter(Dublbubl.row_id == oldest_row_id[0]).first()
-
-                    if row_to_delete:
-                        db.session.delete(row_to_delete)
-                        db.session.commit()
-                    else:
-                        print("Error: Row with row_id {} not found, unable to delete.".format(oldest_row_id[0]))
-                else:
-                    print("Error: oldest_row_id is None, unable to delete row.")
-
-                # Calculate the remaining points in points_tracker
-                remaining_points_in = new_points_in - oldest_row_points_out[0]
-
-                # Update points_tracker with the remaining points
-                points_tracker = PointsTracker.query.first()  # Assuming there's only one row to update
-                points_tracker.current_points_in = remaining_points_in
-                points_tracker.date_created = current_date
-                db.session.commit()
-
-                # Fetch all updated rows to send to the front-end
-                updated_rows = Dublbubl.query.order_by(Dublbubl.row_id.asc()).all()
-
-
-                # Get total row count to calculate total pages
-                total_rows = db.session.query(Dublbubl).count()
-
-                page = request.form.get("page", 1, type=int)
-                print(f"📢 Page received in post request: {page}")  # Debugging output
-                print(f"Request URL: {request.url}")
-                print(f"Request Args: {request.args}")
-
-                # Calculate the total number of pages
-                total_pages = (total_rows + rows_per_page - 1) // rows_per_page  # Round up
-
-                # Calculate the OFFSET based on the current page
-                offset = (page - 1) * rows_per_page
-
-                # Debugging output
-                print(f"Page: {page}, Rows per page: {rows_per_page}, Offset: {offset}")
-                print(f"Fetching rows starting from: {offset}, Limit: {rows_per_page}")
-
-
-                # Fetch rows for the current page using LIMIT and OFFSET
-                updated_rows = Dublbubl.query.order_by(Dublbubl.date_created, Dublbubl.row_id) \
-                    .limit(rows_per_page).offset(offset).all()
-
-                # Serialize Dublbubl objects to dictionaries and remove the internal SQLAlchemy state
-                updated_rows_dict = [
-                    {key: value for key, value in row.__dict__.items() if key != '_sa_instance_state'} 
-                    for row in updated_rows
-                ]
-
-                # Emit the updated rows along with pagination details
-                socketio.emit("update_table", {
-                    "rows": updated_rows_dict,
-                    "total_pages": total_pages,
-                    "current_page": page
-                })
-
-                # Ensure the update is triggered only after database changes
-                print(f"Emitting updated rows to room: {user.id}")
-
-                new_points_in = remaining_points_in
-
-                oldest_row_points_out = Dublbubl.query.with_entities(Dublbubl.points_out) \
-                    .order_by(Dublbubl.row_id.asc()).first()
-
-                # Break the loop if there are no more rows in dublbubl
-                if new_points_in <= 0 or oldest_row_points_out is None:
-                    print("No more rows in dublbubl. Exiting loop.")
-                    break
+            result = ({"error": "Could not create bubble"}, 500)
+        error = get_settlement_error(result)
+        if error:
+            flash(error, "danger")
+            return redirect(url_for("index"))
 
         try:
             points = request.form.get('points')
@@ -795,23 +2657,8 @@ def index():
             # Successfully created bubble
             flash("Bubble created successfully!", "success")
 
-            # Get the current page from the form or query parameters
-            current_page = request.form.get('page') or request.args.get('page', 1)  # Default to 1 if no page param
-            
-            # Convert current_page to an integer
-            current_page = int(current_page)
-
-            # Check if the current page exists (ensure that the page is within valid range)
-            total_rows = Dublbubl.query.count()
-            rows_per_page = 20
-            total_pages = (total_rows + rows_per_page - 1) // rows_per_page  # Calculate total pages
-
-            # If the current page is greater than the total number of pages, set the page to the last valid page
-            if current_page > total_pages:
-                current_page = total_pages if total_pages > 0 else 1
-
-            # Redirect back to the same page, including the page number
-            return redirect(url_for('index', page=current_page))  # Redirect with 'page' query parameter
+            # Redirect back to the page the form was posted from; its cursor still holds however the queue moved
+            return redirect(url_for('index', after=request.form.get('after', type=int)))
 
         except Exception as e:
             flash(f"An error occurred: {str(e)}", "danger")
@@ -820,7 +2667,110 @@ def index():
     else:
         if user is None:
             user = []  # Pass an empty list instead of None if you want to avoid iteration errors
-        return render_template('index.html', dublbubl=dublbubl, user=user, message=message, current_points_in=current_points_in, points_in_required=points_in_required, user_history=user_history, updated_rows=updated_rows, total_pages=total_pages, current_page=page, page=page)
+        return render_template('index.html', dublbubl=dublbubl, user=user, message=message, current_points_in=current_points_in, points_in_required=points_in_required, user_history=user_history, updated_rows=updated_rows, page_after=after, more=more, stream_id=state_stream.stream_id, stream_seq=stream_seq, page_channel=queue_page_room(after), page_seq=page_seq, rows_per_page=ROWS_PER_PAGE, socket_transports=SOCKET_TRANSPORTS, idempotency_key=uuid.uuid4().hex)
+
+
+@app.route("/api/bubbles", methods=["POST"])
+def api_bubbles():
+    """Create one or many bubbles and return the settlement as JSON.
+
+    Accepts {"points": 100}, {"submissions": [{"points": 100}, ...]} or a list
+    of submissions.
+    """
+    user_id = session.get("user_id")
+    if user_id is None:
+        return jsonify({"error": "You must be logged in to create a bubble"}), 401
+
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        body = {"submissions": body}
+    if not isinstance(body, dict):
+        return jsonify({"error": "Invalid request body"}), 400
+
+    submissions = body.get("submissions", [body])
+    if not isinstance(submissions, list) or not submissions:
+        return jsonify({"error": "No submissions"}), 400
+    if len(submissions) > MAX_SUBMISSIONS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_SUBMISSIONS_PER_REQUEST} submissions per request"}), 400
+
+    # A duplicate idempotency key returns the stored response without settling again
+    idempotency_key = get_idempotency_key(request.headers.get("Idempotency-Key") or body.get("idempotency_key"))
+    try:
+        (payload, status), replayed = run_idempotent(
+            user_id,
+            idempotency_key,
+            lambda: settle_api_submissions(user_id, submissions)
+        )
+    except SettlementTimeout:
+        return jsonify({"error": SETTLEMENT_PENDING_ERROR}), 504
+    except Exception as e:
+        print(f"Error inserting row into dublbubl: {e}")
+        return jsonify({"error": "Could not create bubble"}), 500
+    response = jsonify(payload)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response, status
+
+
+def settle_api_submissions(user_id, submissions):
+    """Settle the submissions of one /api/bubbles request or form post, returning (payload, status)."""
+    user = db.session.get(Users, user_id)
+    if user is None:
+        return {"error": "User not found"}, 404
+
+    results = []
+    accepted = []
+    for submission in submissions:
+        points, error = parse_points(submission.get("points") if isinstance(submission, dict) else None)
+        if error:
+            results.append({"status": "error", "error": error})
+        else:
+            results.append(None)
+            accepted.append((len(results) - 1, points))
+
+    # Settle the accepted submissions together in one batch
+    try:
+        settlements = settlement_writer.submit_many(user.id, [points for position, points in accepted])
+    except SettlementTimeout as e:
+        # Still queued on the writer: the payload is built once it settles, see run_idempotent()
+        futures = e.futures
+        e.finish = lambda: settlement_payload(user_id, results, accepted, [future.get() for future in futures])
+        raise
+    except Exception as e:
+        print(f"Error inserting row into dublbubl: {e}")
+        return {"error": "Could not create bubble"}, 500
+    return settlement_payload(user_id, results, accepted, settlements)
+
+
+def settlement_payload(user_id, results, accepted, settlements):
+    """Fill in the results of the accepted submissions and return the response as (payload, status)."""
+    settled = []
+    point_balance = get_point_balance(db.session.get(Users, user_id))
+    until_payout = points_until_payout([result["row"]["row_id"] for result in settlements if "error" not in result])
+    for (position, points), result in zip(accepted, settlements):
+        if "error" in result:
+            results[position] = {"status": "error", "error": result["error"]}
+        else:
+            results[position] = {
+                "status": "ok",
+                "row": result["row"],
+                "settled": result["settled"],
+                "points_until_payout": until_payout[result["row"]["row_id"]]  # None once paid out
+            }
+            settled.extend(result["settled"])
+            point_balance = result["point_balance"]
+
+    head = get_queue_head()
+    points_info = get_points_info()
+    return {
+        "results": results,
+        "point_balance": point_balance,
+        "settled": settled,
+        "queue_head": serialize_row(head) if head else None,
+        "total_rows": get_queue_length(),
+        "current_points_in": points_info.current_points_in,
+        "points_in_required": points_info.points_in_required
+    }, 200
 
 
 if __name__ == "__main__":
@@ -832,6 +2782,15 @@ if __name__ == "__main__":
         # Perform any cleanup here if needed
 
 
+@app.route("/api/bubbles/preview")
+def preview_bubble():
+    """How many queued rows a bubble of ?points= would pay out if it were submitted now."""
+    points, error = parse_points(request.args.get("points"))
+    if error:
+        return jsonify({"error": error}), 400
+    return {"points": points, "rows_cleared": rows_cleared_by(points)}
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     """Register user"""
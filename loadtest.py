@@ -0,0 +1,169 @@
+"""Drive simulated hours of traffic through the real round timer and report database and Socket.IO load.
+
+The app is imported with an accelerated clock (CLOCK_SPEED), so the round
+timer, the lease, the settlement writer and the expiry archive all run
+unmodified while a day of traffic plays out in minutes. Submissions follow a
+daily curve, busiest at noon and quiet around midnight, so rounds expire
+during the quiet hours. Every submission goes through /api/bubbles and every
+broadcast is delivered to in-process Socket.IO test clients.
+
+Usage:
+    python loadtest.py                                  # 24 simulated hours in about 2 minutes
+    python loadtest.py --hours 6 --speed 360 --round-length 1800
+    python loadtest.py --clients 1000 --peak-rate 2000 --engine memory
+    python loadtest.py --clients 500 --pages 5          # clients spread over the first five pages
+"""
+import argparse
+import contextlib
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+from simulate import random_points
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay simulated hours of traffic through the round timer and report load.")
+    parser.add_argument("--hours", type=float, default=24, help="Simulated hours of traffic")
+    parser.add_argument("--speed", type=float, default=720, help="How many times faster than real time the clock runs")
+    parser.add_argument("--round-length", type=int, default=1800, help="Simulated seconds without a new bubble before a round expires")
+    parser.add_argument("--peak-rate", type=float, default=300, help="Submissions per simulated hour at the busiest time of day")
+    parser.add_argument("--users", type=int, default=50, help="Number of users submitting bubbles")
+    parser.add_argument("--clients", type=int, default=200, help="Socket.IO clients watching the dashboard")
+    parser.add_argument("--pages", type=int, default=1, help="Spread the clients over this many queue pages, anchored at the first row ids")
+    parser.add_argument("--engine", choices=["database", "memory"], default="database", help="Queue engine to run")
+    parser.add_argument("--database", help="Scratch SQLite file to use (a temporary file by default)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for generated traffic")
+    return parser.parse_args()
+
+
+def daily_rate(seconds, peak_rate):
+    """Submissions per simulated second, zero at midnight and peak_rate per hour at noon."""
+    return peak_rate / 3600 * (0.5 - 0.5 * math.cos(2 * math.pi * seconds / 86400))
+
+
+def generate_arrivals(duration, peak_rate, rng):
+    """Arrival times in simulated seconds, by thinning a Poisson process at the peak rate."""
+    arrivals = []
+    elapsed = 0.0
+    while True:
+        elapsed += rng.expovariate(peak_rate / 3600)
+        if elapsed >= duration:
+            return arrivals
+        if rng.random() * peak_rate / 3600 < daily_rate(elapsed, peak_rate):
+            arrivals.append(elapsed)
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    arrivals = generate_arrivals(args.hours * 3600, args.peak_rate, rng)
+
+    # Point the app at a scratch database and an accelerated clock before it is imported
+    scratch_dir = tempfile.mkdtemp(prefix="bubble-loadtest-")
+    database = args.database or os.path.join(scratch_dir, "loadtest.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(database)}"
+    os.environ["BUBBLE_ENGINE"] = args.engine
+    os.environ["BUBBLE_JOURNAL"] = os.path.join(scratch_dir, "bubble_journal.log")
+    os.environ["CLOCK_SPEED"] = str(args.speed)
+    os.environ["ROUND_LENGTH"] = str(args.round_length)
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import gevent
+    from sqlalchemy import event, update
+    quiet = open(os.devnull, "w")
+    with contextlib.redirect_stdout(quiet):
+        import app as bubble_app
+    from app import app, db, socketio, Users, Rounds
+
+    print(f"Simulating {args.hours:g} hours ({len(arrivals)} submissions, {args.users} users, {args.clients} clients) "
+          f"at {args.speed:g}x with {args.round_length}s rounds ({args.engine} engine, {database})")
+
+    with contextlib.redirect_stdout(quiet):
+        # Register the users, each with a logged in HTTP client
+        users = []
+        for user_id in range(args.users):
+            client = app.test_client()
+            client.post("/register", data={
+                "username": f"user{user_id}",
+                "email": f"user{user_id}@example.com",
+                "password": "Loadtest1",
+                "confirmation": "Loadtest1"
+            })
+            users.append(client)
+        with app.app_context():
+            db.session.execute(update(Users).values(points=10 ** 12))
+            db.session.commit()
+
+        # Dashboard watchers; the first ones belong to the users so that room emits are counted too
+        clients = [
+            socketio.test_client(app, flask_test_client=users[i]) if i < len(users) else socketio.test_client(app)
+            for i in range(args.clients)
+        ]
+        for i, client in enumerate(clients):
+            # Row ids start at 1, so page p follows row (p - 1) * ROWS_PER_PAGE; the head page has no cursor
+            client.emit("watch_page", {"after": i % args.pages * bubble_app.ROWS_PER_PAGE or None})
+            client.get_received()
+
+        queries = {}
+
+        def count_query(conn, cursor, statement, *args):
+            kind = statement.lstrip().split(None, 1)[0].upper()
+            queries[kind] = queries.get(kind, 0) + 1
+
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", count_query)
+
+        statuses = {}
+
+        def submit(client):
+            response = client.post("/api/bubbles", json={"points": random_points(rng)})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        # Replay the arrivals against the accelerated clock
+        started = time.monotonic()
+        greenlets = []
+        for arrival in arrivals:
+            delay = started + arrival / args.speed - time.monotonic()
+            if delay > 0:
+                gevent.sleep(delay)
+            greenlets.append(gevent.spawn(submit, rng.choice(users)))
+        gevent.joinall(greenlets)
+
+        # Let the last round run out
+        remaining = started + args.hours * 3600 / args.speed - time.monotonic()
+        gevent.sleep(max(remaining, 0) + args.round_length / args.speed + 1)
+        elapsed = time.monotonic() - started
+
+        with app.app_context():
+            rounds = Rounds.query.count()
+        broadcasts = bubble_app.broadcaster.stats()
+        slow_clients = bubble_app.slow_clients.stats()
+        received = {}
+        for client in clients:
+            for packet in client.get_received():
+                received[packet["name"]] = received.get(packet["name"], 0) + 1
+
+    total_queries = sum(queries.values())
+    total_received = sum(received.values())
+    print(f"Wall time: {elapsed:.1f}s for {args.hours * 3600 / elapsed:.0f} simulated seconds per second")
+    print(f"Submissions: {len(arrivals)} sent, responses {dict(sorted(statuses.items()))}")
+    print(f"Rounds expired: {rounds}")
+    print(f"Database queries: {total_queries} ({total_queries / max(len(arrivals), 1):.2f} per submission)")
+    for kind, count in sorted(queries.items(), key=lambda item: -item[1]):
+        print(f"  {kind:<10} {count:>10}")
+    print(f"Socket.IO messages delivered: {total_received} ({total_received / max(len(arrivals), 1):.1f} per submission)")
+    for name, count in sorted(received.items(), key=lambda item: -item[1]):
+        print(f"  {name:<20} {count:>10}")
+    print(f"Broadcasts: {broadcasts['emitted']} emitted, {broadcasts['coalesced']} replaced by a later snapshot, "
+          f"{broadcasts['frames']} frames sent")
+    print(f"Slow clients: {slow_clients['merged']} state frames merged and {slow_clients['dropped']} deltas dropped while held back, "
+          f"{slow_clients['disconnected']} disconnected")
+
+
+if __name__ == "__main__":
+    main()
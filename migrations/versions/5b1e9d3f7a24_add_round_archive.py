@@ -0,0 +1,55 @@
+"""Add rounds and round_rows archive
+
+Revision ID: 5b1e9d3f7a24
+Revises: 8f2d4c1a9b7e
+Create Date: 2026-10-18 14:37:05.902611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e9d3f7a24'
+down_revision = '8f2d4c1a9b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rounds',
+    sa.Column('round_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('started_at', sa.String(length=255), nullable=True),
+    sa.Column('ended_at', sa.String(length=255), nullable=False),
+    sa.Column('total_rows', sa.Integer(), nullable=False),
+    sa.Column('volume', sa.Integer(), nullable=False),
+    sa.Column('rows_paid', sa.Integer(), nullable=False),
+    sa.Column('points_paid', sa.Integer(), nullable=False),
+    sa.Column('rows_forfeited', sa.Integer(), nullable=False),
+    sa.Column('points_forfeited', sa.Integer(), nullable=False),
+    sa.Column('pool_forfeited', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('round_id')
+    )
+    op.create_table('round_rows',
+    sa.Column('round_row_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('round_id', sa.Integer(), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=150), nullable=False),
+    sa.Column('points_in', sa.Integer(), nullable=False),
+    sa.Column('points_out', sa.Integer(), nullable=False),
+    sa.Column('date_created', sa.String(length=255), nullable=False),
+    sa.ForeignKeyConstraint(['round_id'], ['rounds.round_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('round_row_id')
+    )
+    with op.batch_alter_table('round_rows', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_round_rows_round_id'), ['round_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('round_rows', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_round_rows_round_id'))
+
+    op.drop_table('round_rows')
+    op.drop_table('rounds')
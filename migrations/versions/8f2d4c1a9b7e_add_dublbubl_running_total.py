@@ -0,0 +1,34 @@
+"""Add running total to dublbubl
+
+Revision ID: 8f2d4c1a9b7e
+Revises: 3c60a693c3b1
+Create Date: 2026-10-18 09:12:44.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d4c1a9b7e'
+down_revision = '3c60a693c3b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('dublbubl', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('running_total', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_dublbubl_running_total'), ['running_total'], unique=False)
+
+    # Backfill the running total of rows that are already queued
+    op.execute(
+        "UPDATE dublbubl SET running_total = "
+        "(SELECT SUM(queued.points_out) FROM dublbubl AS queued WHERE queued.row_id <= dublbubl.row_id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('dublbubl', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_dublbubl_running_total'))
+        batch_op.drop_column('running_total')
@@ -0,0 +1,32 @@
+"""Add queue position to dublbubl
+
+Revision ID: a9d4e2c7b031
+Revises: e7c3a1f09b58
+Create Date: 2026-10-18 17:20:11.604938
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e2c7b031'
+down_revision = 'e7c3a1f09b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('dublbubl', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('queue_position', sa.Integer(), nullable=True))
+
+    # Backfill the position of rows that are already queued
+    op.execute(
+        "UPDATE dublbubl SET queue_position = "
+        "(SELECT COUNT(*) FROM dublbubl AS queued WHERE queued.row_id <= dublbubl.row_id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('dublbubl', schema=None) as batch_op:
+        batch_op.drop_column('queue_position')
@@ -0,0 +1,32 @@
+"""Add last history id to rounds
+
+Revision ID: c2f8b6d4e190
+Revises: a9d4e2c7b031
+Create Date: 2026-10-18 18:05:37.214690
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f8b6d4e190'
+down_revision = 'a9d4e2c7b031'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('rounds', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_history_id', sa.Integer(), nullable=True))
+
+    # Backfill the marker of rounds that are already archived from their end time
+    op.execute(
+        "UPDATE rounds SET last_history_id = "
+        "(SELECT COALESCE(MAX(history_id), 0) FROM dublbubl_history WHERE dublbubl_history.date_archived <= rounds.ended_at)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('rounds', schema=None) as batch_op:
+        batch_op.drop_column('last_history_id')
@@ -0,0 +1,29 @@
+"""Add leases lock table
+
+Revision ID: d4a7c2e8b915
+Revises: 5b1e9d3f7a24
+Create Date: 2026-10-18 16:02:51.477310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c2e8b915'
+down_revision = '5b1e9d3f7a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('leases',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('owner', sa.String(length=100), nullable=True),
+    sa.Column('expires_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('leases')
@@ -0,0 +1,38 @@
+"""Add queue counters to points_tracker
+
+Revision ID: e7c3a1f09b58
+Revises: d4a7c2e8b915
+Create Date: 2026-10-18 16:48:20.531977
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c3a1f09b58'
+down_revision = 'd4a7c2e8b915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('points_tracker', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('queue_length', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('queued_points_in', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('queued_points_out', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the counters from the rows that are already queued
+    op.execute(
+        "UPDATE points_tracker SET "
+        "queue_length = (SELECT COUNT(*) FROM dublbubl), "
+        "queued_points_in = (SELECT COALESCE(SUM(points_in), 0) FROM dublbubl), "
+        "queued_points_out = (SELECT COALESCE(SUM(points_out), 0) FROM dublbubl)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('points_tracker', schema=None) as batch_op:
+        batch_op.drop_column('queued_points_out')
+        batch_op.drop_column('queued_points_in')
+        batch_op.drop_column('queue_length')
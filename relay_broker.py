@@ -0,0 +1,39 @@
+"""Local broker that relays broadcast events between the app's worker processes.
+
+Every worker publishes to RELAY_PUBLISH_URL and subscribes to
+RELAY_SUBSCRIBE_URL. The broker forwards each message to every subscriber,
+so a batch settled or a round expired on one worker reaches the clients of
+all of them. Run one broker next to the workers, on the same host.
+
+Usage:
+    RELAY_PUBLISH_URL=ipc:///tmp/bubble-relay-in RELAY_SUBSCRIBE_URL=ipc:///tmp/bubble-relay-out python relay_broker.py
+"""
+import os
+import sys
+
+import zmq
+from dotenv import load_dotenv
+
+
+def main():
+    load_dotenv()
+    publish_url = os.getenv("RELAY_PUBLISH_URL")
+    subscribe_url = os.getenv("RELAY_SUBSCRIBE_URL")
+    if not publish_url or not subscribe_url:
+        sys.exit("Set RELAY_PUBLISH_URL and RELAY_SUBSCRIBE_URL to the addresses the workers use")
+
+    context = zmq.Context()
+    workers_in = context.socket(zmq.XSUB)  # Workers publish here
+    workers_in.bind(publish_url)
+    workers_out = context.socket(zmq.XPUB)  # Workers subscribe here
+    workers_out.bind(subscribe_url)
+
+    print(f"Relaying from {publish_url} to {subscribe_url}", flush=True)
+    try:
+        zmq.proxy(workers_in, workers_out)
+    except KeyboardInterrupt:
+        print("Shutting down the relay broker...")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Replay a log of bubble submissions against a scratch database and report throughput.
+
+Submissions go through submit_bubble(), so they follow the same payout rules
+as index(): the multiplier tiers, the points_tracker pool and the archival of
+paid out rows into dublbubl_history. For every queue size the scratch database
+is seeded with that many queued rows before the log is replayed.
+
+Usage:
+    python simulate.py                                  # generated log, queues of 1k, 100k and 1M rows
+    python simulate.py --submissions 5000 --queue-sizes 1000 100000
+    python simulate.py --save-log submissions.csv       # keep the generated log
+    python simulate.py --log submissions.csv --engine memory
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay bubble submissions and report settlement throughput.")
+    parser.add_argument("--log", help="CSV submission log with user, points and timestamp columns (generated if omitted)")
+    parser.add_argument("--save-log", help="Write the generated submission log to this CSV file")
+    parser.add_argument("--submissions", type=int, default=1000, help="Number of submissions to generate")
+    parser.add_argument("--users", type=int, default=100, help="Number of users to generate")
+    parser.add_argument("--queue-sizes", type=int, nargs="+", default=[1000, 100000, 1000000], help="Queued rows to seed before each replay")
+    parser.add_argument("--engine", choices=["database", "memory"], default="database", help="Queue engine to benchmark")
+    parser.add_argument("--database", help="Scratch SQLite file to use (a temporary file by default)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for generated data")
+    return parser.parse_args()
+
+
+def random_points(rng):
+    """Pick points across the multiplier tiers, weighted towards small bubbles."""
+    tier = rng.random()
+    if tier < 0.6:
+        return rng.randint(1, 999)
+    elif tier < 0.85:
+        return rng.randint(1000, 4999)
+    elif tier < 0.97:
+        return rng.randint(5000, 9999)
+    return 10000
+
+
+def generate_log(count, users, rng):
+    """Generate submissions spread evenly over one day."""
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        {
+            "user": rng.randint(1, users),
+            "points": random_points(rng),
+            "timestamp": (start + datetime.timedelta(seconds=i * 86400 / count)).strftime("%Y-%m-%d %H:%M:%S")
+        } for i in range(count)
+    ]
+
+
+def load_log(path):
+    with open(path, newline="") as log_file:
+        return [
+            {"user": int(row["user"]), "points": int(row["points"]), "timestamp": row["timestamp"]}
+            for row in csv.DictReader(log_file)
+        ]
+
+
+def save_log(path, log):
+    with open(path, "w", newline="") as log_file:
+        writer = csv.DictWriter(log_file, fieldnames=["user", "points", "timestamp"])
+        writer.writeheader()
+        writer.writerows(log)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else 0
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    if args.log:
+        log = load_log(args.log)
+    else:
+        log = generate_log(args.submissions, args.users, rng)
+        if args.save_log:
+            save_log(args.save_log, log)
+    log.sort(key=lambda submission: submission["timestamp"])
+    users = max(args.users, max(submission["user"] for submission in log))
+
+    # Point the app at a scratch database before it is imported
+    scratch_dir = tempfile.mkdtemp(prefix="bubble-simulate-")
+    database = args.database or os.path.join(scratch_dir, "simulate.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(database)}"
+    os.environ["BUBBLE_ENGINE"] = args.engine
+    os.environ["BUBBLE_JOURNAL"] = os.path.join(scratch_dir, "bubble_journal.log")
+    os.environ.setdefault("SECRET_KEY", "simulate")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from sqlalchemy import event, insert
+    import app as bubble_app
+    from app import app, db, Users, Dublbubl, DublbublHistory, PointsTracker, calculate_points_out, submit_bubble
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    print(f"Replaying {len(log)} submissions from {users} users ({args.engine} engine, {database})")
+    print(f"{'queue rows':>12} {'subs/s':>10} {'queries/sub':>12} {'p50 ms':>9} {'p99 ms':>9} {'rows paid':>10}")
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", count_query)
+
+        for queue_size in args.queue_sizes:
+            # Reset the scratch database
+            for model in (DublbublHistory, Dublbubl, PointsTracker, Users):
+                db.session.query(model).delete()
+            db.session.execute(insert(Users), [
+                {"id": user_id, "username": f"user{user_id}", "hash": "", "points": 10 ** 12, "total_points_earned": 0, "email": f"user{user_id}@example.com"}
+                for user_id in range(1, users + 1)
+            ])
+
+            # Seed the queue in chunks
+            running_total = 0
+            queued_points_in = 0
+            for chunk_start in range(0, queue_size, 10000):
+                rows = []
+                for row_id in range(chunk_start + 1, min(chunk_start + 10000, queue_size) + 1):
+                    points = random_points(rng)
+                    running_total += calculate_points_out(points)
+                    queued_points_in += points
+                    user_id = rng.randint(1, users)
+                    rows.append({
+                        "row_id": row_id,
+                        "user_id": user_id,
+                        "username": f"user{user_id}",
+                        "points_in": points,
+                        "points_out": calculate_points_out(points),
+                        "date_created": log[0]["timestamp"],
+                        "running_total": running_total,
+                        "queue_position": row_id
+                    })
+                db.session.execute(insert(Dublbubl), rows)
+
+            # The queue counters start from the seeded rows; running_total is their points_out sum
+            db.session.add(PointsTracker(
+                current_points_in=0,
+                date_created=log[0]["timestamp"],
+                queue_length=queue_size,
+                queued_points_in=queued_points_in,
+                queued_points_out=running_total
+            ))
+            db.session.commit()
+
+            if bubble_app.bubble_queue is not None:
+                bubble_app.bubble_queue.load()
+
+            latencies = []
+            rows_paid = 0
+            queries[0] = 0
+            started = time.perf_counter()
+            for submission in log:
+                user = db.session.get(Users, submission["user"])
+                submitted = time.perf_counter()
+                result = submit_bubble(user, submission["points"])
+                latencies.append(time.perf_counter() - submitted)
+                rows_paid += len(result["settled"])
+
+            # Writes held back by the memory engine count towards the total
+            if bubble_app.bubble_queue is not None:
+                bubble_app.bubble_queue.flush()
+            elapsed = time.perf_counter() - started
+
+            print(
+                f"{queue_size:>12} {len(log) / elapsed:>10.1f} {queries[0] / len(log):>12.2f} "
+                f"{percentile(latencies, 0.5) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f} {rows_paid:>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()